@@ -0,0 +1,84 @@
+"""Benchmark HTML rendering of a fully cached summary
+
+On a fully cached run only the footer changes, so the per-section fragment
+cache means only the footer (which is never cached) needs rendering again.
+
+    python benchmarks/bench_render.py [path/to/summary.md] [runs]
+"""
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from i_hate_papers.html_utils import (
+    FragmentRenderer,
+    MARKDOWN_EXTENSIONS,
+    MARKDOWN_EXTENSION_CONFIGS,
+)
+
+EXAMPLE = (
+    Path(__file__).parent.parent
+    / "examples"
+    / "summary-2106.09685-d1-gpt-3.5-turbo-16k.md"
+)
+
+
+def _documents(markdown_text: str, runs: int):
+    # Each run differs only in the footer's timestamp. Yields (body, footer)
+    for _ in range(runs):
+        yield (
+            markdown_text,
+            f"# About this summary\n\n"
+            f"Summary was created at `{datetime.now(timezone.utc).isoformat()}`\n",
+        )
+
+
+def render_uncached(markdown_text: str, runs: int) -> float:
+    """How _write_output used to render: a new Markdown instance, whole document"""
+    import markdown
+
+    start = time.perf_counter()
+    for body, footer in _documents(markdown_text, runs):
+        md = markdown.Markdown(
+            extensions=MARKDOWN_EXTENSIONS,
+            extension_configs=MARKDOWN_EXTENSION_CONFIGS,
+        )
+        md.convert(body + "\n\n" + footer)
+    return time.perf_counter() - start
+
+
+def render_fragments(markdown_text: str, runs: int, cache_dir: Path) -> float:
+    # Warm the disk cache, as a previous run would have
+    FragmentRenderer(cache_dir=cache_dir).render(markdown_text)
+
+    start = time.perf_counter()
+    for body, footer in _documents(markdown_text, runs):
+        # Each run is a new process, so starts with an empty in-memory cache
+        renderer = FragmentRenderer(cache_dir=cache_dir)
+        renderer.render(body)
+        renderer.render(footer, persist=False)
+    return time.perf_counter() - start
+
+
+def main():
+    path = Path(sys.argv[1]) if len(sys.argv) > 1 else EXAMPLE
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    markdown_text = path.read_text("utf8")
+
+    uncached = render_uncached(markdown_text, runs)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        fragments = render_fragments(markdown_text, runs, Path(cache_dir))
+
+    print(f"Rendered {path.name} {runs} times ({len(markdown_text):,} chars)")
+    print(
+        f"    Whole document, new renderer: {uncached / runs * 1000:8.2f}ms per render"
+    )
+    print(
+        f"    Cached fragments:             {fragments / runs * 1000:8.2f}ms per render"
+    )
+    print(f"    Speedup:                      {uncached / fragments:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
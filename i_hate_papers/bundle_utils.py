@@ -0,0 +1,270 @@
+import io
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+from datetime import datetime, timezone
+from hashlib import sha256
+from pathlib import Path
+from typing import Optional
+
+from i_hate_papers.search_index import SearchIndex
+from i_hate_papers.settings import CACHE_DIR
+from i_hate_papers.similarity import SimilarityIndex
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_FORMAT_VERSION = 1
+
+# Which parts of the cache directory make up each category
+CACHE_DIRECTORIES = {
+    "summaries": "summaries",
+    "derived-summaries": "derived-summaries",
+    "key-terms": "key-terms",
+    "html-fragments": "html-fragments",
+}
+INDEX_FILES = ("similarity.sqlite3", "search.sqlite3")
+CATEGORIES = ("sources", *CACHE_DIRECTORIES, "indexes")
+
+# Records which bundles have been imported into this cache
+IMPORTED_BUNDLES_FILE = "imported-bundles.txt"
+
+
+class BundleError(Exception):
+    pass
+
+
+def _hash_file(path: Path) -> str:
+    digest = sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _object_name(digest: str) -> str:
+    return f"objects/{digest[:2]}/{digest}"
+
+
+def _snapshot_sqlite(path: Path, snapshot_path: Path):
+    """Copy an SQLite database safely, even if it is in use"""
+    source = sqlite3.connect(path)
+    target = sqlite3.connect(snapshot_path)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+
+
+def _collect_files(
+    categories: tuple[str, ...], cache_dir: Path, snapshot_dir: Path
+) -> dict[str, Path]:
+    """Get the files to bundle, as a dict of path (relative to the cache dir) to file on disk"""
+    files = {}
+    for category in categories:
+        if category == "sources":
+            for path in cache_dir.glob("*.tar"):
+                files[path.name] = path
+        elif category == "indexes":
+            for name in INDEX_FILES:
+                if (cache_dir / name).exists():
+                    _snapshot_sqlite(cache_dir / name, snapshot_dir / name)
+                    files[name] = snapshot_dir / name
+        elif category in CACHE_DIRECTORIES:
+            directory = cache_dir / CACHE_DIRECTORIES[category]
+            for path in directory.glob("*"):
+                if path.is_file():
+                    files[f"{directory.name}/{path.name}"] = path
+        else:
+            raise BundleError(
+                f"Unknown category: {category}. Must be one of: {', '.join(CATEGORIES)}"
+            )
+    return files
+
+
+# Not part of the content, so not part of the bundle ID
+UNHASHED_MANIFEST_KEYS = ("id", "created")
+
+
+def _manifest_id(manifest: dict) -> str:
+    """Identical content always gives the same ID, whenever it was exported"""
+    manifest = {k: v for k, v in manifest.items() if k not in UNHASHED_MANIFEST_KEYS}
+    return sha256(json.dumps(manifest, sort_keys=True).encode("utf8")).hexdigest()
+
+
+def read_manifest(bundle_path: Path) -> dict:
+    try:
+        tar = tarfile.open(bundle_path)
+    except tarfile.ReadError:
+        raise BundleError(f"Not a cache bundle, unable to read it: {bundle_path}")
+    with tar:
+        try:
+            return json.load(tar.extractfile("manifest.json"))
+        except KeyError:
+            raise BundleError(f"Not a cache bundle, no manifest found: {bundle_path}")
+
+
+def export_bundle(
+    output_dir: Path,
+    categories: tuple[str, ...] = CATEGORIES,
+    since: Optional[Path] = None,
+    cache_dir: Path = CACHE_DIR,
+) -> Optional[Path]:
+    """Pack the cache into a single compressed bundle
+
+    Files are stored by the SHA-256 of their content, and the manifest maps
+    cache paths to those hashes. The bundle itself is named after the hash of
+    its manifest. Given `since` (a previous bundle), only files which are new or
+    changed since that bundle are included.
+
+    Returns the path to the bundle, or None if there was nothing to export.
+    """
+    base_id = None
+    base_files = {}
+    if since:
+        base_manifest = read_manifest(since)
+        base_id = base_manifest["id"]
+        base_files = base_manifest["state"]
+
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        files = _collect_files(categories, cache_dir, Path(snapshot_dir))
+        hashes = {name: _hash_file(path) for name, path in files.items()}
+        changed = {
+            name: digest
+            for name, digest in hashes.items()
+            if base_files.get(name) != digest
+        }
+        if not changed:
+            logger.info("Nothing has changed, no bundle created")
+            return None
+
+        manifest = {
+            "version": BUNDLE_FORMAT_VERSION,
+            "created": datetime.now(timezone.utc).isoformat(),
+            "base": base_id,
+            "categories": list(categories),
+            # The files in this bundle
+            "files": dict(sorted(changed.items())),
+            # Every file in the cache at the time of export, so later bundles
+            # can contain only what has changed since this one
+            "state": dict(sorted(hashes.items())),
+        }
+        bundle_id = _manifest_id(manifest)
+        manifest["id"] = bundle_id
+        manifest_bytes = json.dumps(manifest, indent=2, sort_keys=True).encode("utf8")
+
+        output_dir.mkdir(parents=True, exist_ok=True)
+        bundle_path = output_dir / f"i-hate-papers-cache-{bundle_id[:16]}.tar.gz"
+        tmp_path = bundle_path.with_suffix(".tmp")
+        with tarfile.open(tmp_path, "w:gz") as tar:
+            info = tarfile.TarInfo("manifest.json")
+            info.size = len(manifest_bytes)
+            tar.addfile(info, io.BytesIO(manifest_bytes))
+
+            # Identical content is only stored once
+            added = set()
+            for name, digest in changed.items():
+                if digest not in added:
+                    tar.add(files[name], arcname=_object_name(digest))
+                    added.add(digest)
+        os.replace(tmp_path, bundle_path)
+
+    logger.info(
+        f"Exported {len(changed):,} files ({len(added):,} unique) to {bundle_path}"
+        + (f", since bundle {base_id[:16]}" if base_id else "")
+    )
+    return bundle_path
+
+
+def import_bundle(bundle_path: Path, cache_dir: Path = CACHE_DIR) -> dict[str, int]:
+    """Unpack a bundle into the cache, verifying the integrity of every file
+
+    Nothing is written to the cache unless the whole bundle is intact. Indexes
+    are merged into any existing indexes rather than replacing them. Returns counts
+    of files which were imported, skipped (already present), and merged.
+    """
+    stats = {"imported": 0, "skipped": 0, "merged": 0}
+    manifest = read_manifest(bundle_path)
+    if manifest.get("version") != BUNDLE_FORMAT_VERSION:
+        raise BundleError(f"Unsupported bundle version: {manifest.get('version')}")
+    if manifest.get("id") != _manifest_id(manifest):
+        raise BundleError("Bundle is corrupt, the manifest does not match its ID")
+
+    imported_bundles_path = cache_dir / IMPORTED_BUNDLES_FILE
+    imported_bundles = (
+        imported_bundles_path.read_text("utf8").split()
+        if imported_bundles_path.exists()
+        else []
+    )
+    if manifest["base"] and manifest["base"] not in imported_bundles:
+        logger.warning(
+            f"This bundle only contains changes since bundle {manifest['base'][:16]}, "
+            f"which has not been imported. The cache will be incomplete."
+        )
+
+    for name in manifest["files"]:
+        target = (cache_dir / name).resolve()
+        if cache_dir.resolve() not in target.parents:
+            raise BundleError(f"Refusing to write outside of the cache: {name}")
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # Objects are verified in a staging area before anything is written to the cache
+    with tempfile.TemporaryDirectory(dir=cache_dir, prefix=".import-") as staging_dir:
+        staging_dir = Path(staging_dir)
+
+        # Verify everything before writing anything
+        with tarfile.open(bundle_path) as tar:
+            for digest in set(manifest["files"].values()):
+                try:
+                    source = tar.extractfile(_object_name(digest))
+                except KeyError:
+                    raise BundleError(f"Bundle is missing object {digest}")
+
+                hasher = sha256()
+                with (staging_dir / digest).open("wb") as f:
+                    for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                        hasher.update(chunk)
+                        f.write(chunk)
+                if hasher.hexdigest() != digest:
+                    raise BundleError(
+                        f"Bundle is corrupt, object {digest} has the wrong hash"
+                    )
+
+        for name, digest in manifest["files"].items():
+            staged = staging_dir / digest
+            if name in INDEX_FILES:
+                _merge_index(name, staged, cache_dir)
+                stats["merged"] += 1
+                continue
+
+            target = cache_dir / name
+            if target.exists() and _hash_file(target) == digest:
+                stats["skipped"] += 1
+                continue
+
+            target.parent.mkdir(parents=True, exist_ok=True)
+            # Copy rather than move, the same content may be used by several files
+            tmp_path = target.with_name(f".{target.name}.tmp")
+            shutil.copyfile(staged, tmp_path)
+            os.replace(tmp_path, target)
+            stats["imported"] += 1
+
+    with imported_bundles_path.open("a") as f:
+        f.write(manifest["id"] + "\n")
+
+    logger.info(
+        f"Imported bundle {manifest['id'][:16]}: {stats['imported']:,} files imported, "
+        f"{stats['skipped']:,} already present, {stats['merged']:,} indexes merged"
+    )
+    return stats
+
+
+def _merge_index(name: str, path: Path, cache_dir: Path):
+    if name == "similarity.sqlite3":
+        SimilarityIndex(path=cache_dir / name).merge_from(path)
+    elif name == "search.sqlite3":
+        SearchIndex(path=cache_dir / name).merge_from(path)
@@ -1,5 +1,11 @@
+import re
+import threading
+from collections import OrderedDict
+from hashlib import sha1
+
 from i_hate_papers import md_parser
 from i_hate_papers.markdown_utils import process_markdown_content
+from i_hate_papers.settings import CACHE_DIR
 
 COMMON_SECTION_NAMES = (
     "abstract",
@@ -11,9 +17,116 @@ COMMON_SECTION_NAMES = (
     "acknowledgements",
 )
 
+MARKDOWN_EXTENSIONS = ["mdx_math", "tables"]
+MARKDOWN_EXTENSION_CONFIGS = {"mdx_math": {"enable_dollar_delimiter": True}}
+
+# Rendered fragments held in memory, on top of those cached on disk
+FRAGMENT_MEMORY_CACHE_SIZE = 2_000
+
+# Reference-style link (and footnote) definitions, i.e. "[1]: https://example.com"
+REFERENCE_DEFINITION_REGEX = re.compile(r"^ {0,3}\[[^\]]+\]:", re.MULTILINE)
+
 
 def process_html_content(content: str) -> tuple[str, dict[str, str]]:
     import html2text
 
     markdown = html2text.html2text(content)
     return process_markdown_content(markdown)
+
+
+class FragmentRenderer:
+    """Renders markdown to HTML one section at a time, caching each section's HTML
+
+    Most of a document is unchanged between runs (only the footer changes when
+    everything else comes from the cache), so only the changed sections need
+    rendering. Content which differs on every run, such as the footer, should be
+    rendered with `persist=False` so that it doesn't fill up the cache. A single
+    `markdown.Markdown` instance is reused for every conversion.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR / "html-fragments"):
+        self.cache_dir = cache_dir
+        self._md = None
+        self._lock = threading.Lock()
+        self._memory_cache = OrderedDict()
+        # Changing the extensions changes the output, so must change the cache keys
+        self._cache_salt = repr((MARKDOWN_EXTENSIONS, MARKDOWN_EXTENSION_CONFIGS))
+
+    def render(self, markdown_text: str, persist: bool = True) -> str:
+        """Render a whole markdown document to HTML"""
+        # References may be defined in a different section to where they are used,
+        # in which case the sections can't be rendered separately
+        if REFERENCE_DEFINITION_REGEX.search(markdown_text):
+            return self.render_fragment(markdown_text, persist=persist)
+
+        return "\n".join(
+            self.render_fragment(f, persist=persist)
+            for f in split_fragments(markdown_text)
+        )
+
+    def render_fragment(self, fragment: str, persist: bool = True) -> str:
+        if not persist:
+            return self._convert(fragment)
+
+        key = sha1((self._cache_salt + fragment).encode("utf8")).hexdigest()
+
+        with self._lock:
+            if key in self._memory_cache:
+                self._memory_cache.move_to_end(key)
+                return self._memory_cache[key]
+
+        cache_path = self.cache_dir / key
+        if cache_path.exists():
+            html = cache_path.read_text("utf8")
+        else:
+            html = self._convert(fragment)
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            cache_path.write_text(html, "utf8")
+
+        with self._lock:
+            self._memory_cache[key] = html
+            if len(self._memory_cache) > FRAGMENT_MEMORY_CACHE_SIZE:
+                self._memory_cache.popitem(last=False)
+        return html
+
+    def _convert(self, markdown_text: str) -> str:
+        # Markdown instances aren't thread safe
+        with self._lock:
+            if self._md is None:
+                import markdown
+
+                self._md = markdown.Markdown(
+                    extensions=MARKDOWN_EXTENSIONS,
+                    extension_configs=MARKDOWN_EXTENSION_CONFIGS,
+                )
+            try:
+                return self._md.convert(markdown_text)
+            finally:
+                self._md.reset()
+
+
+_renderer = FragmentRenderer()
+
+
+def render_markdown(markdown_text: str, persist: bool = True) -> str:
+    """Render markdown to HTML using the shared renderer & fragment cache"""
+    return _renderer.render(markdown_text, persist=persist)
+
+
+def split_fragments(markdown_text: str) -> list[str]:
+    """Split markdown into fragments at each heading, which can be rendered independently"""
+    fragments = []
+    current = []
+    in_code_block = False
+
+    for line in markdown_text.splitlines(keepends=True):
+        if line.lstrip().startswith("```"):
+            in_code_block = not in_code_block
+        if not in_code_block and md_parser.get_heading_depth(line) and current:
+            fragments.append("".join(current))
+            current = []
+        current.append(line)
+
+    if current:
+        fragments.append("".join(current))
+    return fragments
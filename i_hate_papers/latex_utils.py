@@ -58,3 +58,130 @@ def process_latex_content(
         sections[section_title] = section_text
 
     return title, sections
+
+
+# Environments which are replaced with a short placeholder before summarising
+ELIDED_ENVIRONMENTS = {
+    "table": "[Table omitted]",
+    "tabular": "[Table omitted]",
+    "algorithm": "[Algorithm omitted]",
+    "algorithmic": "[Algorithm omitted]",
+    "tikzpicture": "[Diagram omitted]",
+    "figure": "[Figure omitted]",
+    "lstlisting": "[Code listing omitted]",
+    "verbatim": "[Code listing omitted]",
+    "thebibliography": "",
+}
+
+# Display math environments, which are shortened rather than dropped
+MATH_ENVIRONMENTS = (
+    "equation",
+    "align",
+    "gather",
+    "multline",
+    "eqnarray",
+    "displaymath",
+)
+
+MACRO_DEFINITION_REGEXES = (
+    # \newcommand{\name}[2]{body}, \renewcommand\name{body}
+    re.compile(
+        r"\\(?:re)?newcommand\*?\s*\{?\\([a-zA-Z]+)\}?\s*(?:\[(\d)\])?\s*\{((?:[^{}]|\{(?:[^{}]|\{[^{}]*\})*\})*)\}"
+    ),
+    # \def\name{body}
+    re.compile(r"\\def\s*\\([a-zA-Z]+)()\s*\{((?:[^{}]|\{(?:[^{}]|\{[^{}]*\})*\})*)\}"),
+    # \DeclareMathOperator{\name}{body}
+    re.compile(
+        r"\\DeclareMathOperator\*?\s*\{\\([a-zA-Z]+)\}()\s*\{((?:[^{}]|\{[^{}]*\})*)\}"
+    ),
+)
+
+
+def extract_macros(content: str) -> dict[str, tuple[int, str]]:
+    """Find custom macro definitions in the latex source
+
+    Returns a dict of macro name to (number of arguments, body)
+    """
+    macros = {}
+    for regex in MACRO_DEFINITION_REGEXES:
+        for match in regex.finditer(content):
+            name, num_args, body = match.groups()
+            macros[name] = (int(num_args or 0), body)
+    return macros
+
+
+def expand_macros(content: str, macros: dict[str, tuple[int, str]]) -> str:
+    """Expand custom macros, so the model doesn't need to see the definitions"""
+    # Don't try to expand the definitions themselves
+    for regex in MACRO_DEFINITION_REGEXES:
+        content = regex.sub("", content)
+
+    # Longest names first, so \foobar is expanded before \foo
+    for name in sorted(macros, key=len, reverse=True):
+        num_args, body = macros[name]
+        args_regex = r"\s*\{([^{}]*)\}" * num_args
+
+        def _replace(match, body=body):
+            expanded = body
+            for i, arg in enumerate(match.groups(), start=1):
+                expanded = expanded.replace(f"#{i}", arg)
+            return expanded
+
+        content = re.sub(rf"\\{name}(?![a-zA-Z]){args_regex}", _replace, content)
+    return content
+
+
+def reduce_latex_content(
+    content: str,
+    macros: dict[str, tuple[int, str]] = None,
+    elided_environments: dict[str, str] = None,
+    max_math_chars: int = 80,
+) -> str:
+    """Strip the parts of a latex section which cost tokens but add little to a summary
+
+    Custom macros are expanded, tables/algorithms/diagrams are replaced with a
+    placeholder, the bibliography is removed, and any math longer than
+    `max_math_chars` is shortened. Pass `max_math_chars=None` to leave math alone.
+    """
+    if elided_environments is None:
+        elided_environments = ELIDED_ENVIRONMENTS
+
+    if macros:
+        content = expand_macros(content, macros)
+
+    for env_name, placeholder in elided_environments.items():
+        content = re.sub(
+            rf"\\begin\{{{env_name}\*?\}}.*?\\end\{{{env_name}\*?\}}",
+            placeholder,
+            content,
+            flags=re.DOTALL,
+        )
+
+    content = re.sub(r"\\bibliography(?:style)?\{[^}]*\}", "", content)
+
+    if max_math_chars is not None:
+        content = _shorten_math(content, max_math_chars)
+
+    # Collapse the blank lines left behind
+    content = re.sub(r"\n\s*\n(\s*\n)+", "\n\n", content)
+    return content
+
+
+def _shorten_math(content: str, max_math_chars: int) -> str:
+    def _shorten(match):
+        math = match.group(0)
+        if len(math) <= max_math_chars:
+            return math
+        return "[Equation omitted]"
+
+    envs = "|".join(MATH_ENVIRONMENTS)
+    content = re.sub(
+        rf"\\begin\{{({envs})\*?\}}.*?\\end\{{\1\*?\}}",
+        _shorten,
+        content,
+        flags=re.DOTALL,
+    )
+    content = re.sub(r"\$\$.+?\$\$", _shorten, content, flags=re.DOTALL)
+    content = re.sub(r"\\\[.+?\\\]", _shorten, content, flags=re.DOTALL)
+    content = re.sub(r"(?<![\\$])\$[^$]+\$", _shorten, content)
+    return content
@@ -0,0 +1,143 @@
+import json
+import logging
+import threading
+from typing import Optional
+
+from i_hate_papers.settings import API_BASE, API_KEY, API_POOL_SIZE, API_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class BackendError(Exception):
+    pass
+
+
+class ContextLengthExceeded(BackendError):
+    pass
+
+
+class RequestTimeout(BackendError):
+    pass
+
+
+class Backend:
+    """Something which can answer chat completion requests"""
+
+    def complete(
+        self, messages: list[dict], model: str, timeout: float = None, **params
+    ) -> str:
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class OpenAICompatibleBackend(Backend):
+    """Talks to an OpenAI-compatible `/chat/completions` endpoint over HTTP
+
+    A single `requests.Session` is kept for the lifetime of the backend, so
+    connections (and their TLS handshakes) are pooled and reused between calls.
+    Point `base_url` at a local server (llama.cpp, vLLM, Ollama, etc) to use
+    self-hosted models.
+    """
+
+    def __init__(
+        self,
+        base_url: str = API_BASE,
+        api_key: Optional[str] = API_KEY,
+        timeout: float = API_TIMEOUT,
+        pool_size: int = API_POOL_SIZE,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._session = None
+        # Requests are made from several threads, which must all share one session
+        self._session_lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"{self.base_url}/chat/completions"
+
+    @property
+    def headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    @property
+    def session(self):
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=self.pool_size, pool_maxsize=self.pool_size
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update(self.headers)
+                self._session = session
+            return self._session
+
+    def complete(
+        self, messages: list[dict], model: str, timeout: float = None, **params
+    ) -> str:
+        """Get a chat completion, waiting up to `timeout` seconds (or the backend default)"""
+        import requests
+
+        payload = dict(model=model, messages=messages, **params)
+        timeout = self.timeout if timeout is None else timeout
+        logger.debug(f"POST {self.url}: {timeout=} {payload=}")
+        try:
+            response = self.session.post(self.url, json=payload, timeout=timeout)
+        except requests.Timeout as e:
+            raise RequestTimeout(f"Request timed out after {timeout:g}s: {e}")
+        return _parse_response(response.status_code, response.text)
+
+    def close(self):
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+def _parse_response(status_code: int, body: str) -> str:
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = None
+
+    if status_code >= 400:
+        error = (data.get("error") if isinstance(data, dict) else None) or {}
+        if isinstance(error, dict) and error.get("code") == "context_length_exceeded":
+            raise ContextLengthExceeded(error.get("message", ""))
+        raise BackendError(f"Request failed ({status_code}): {error or body[:500]}")
+
+    try:
+        return data["choices"][0]["message"]["content"].strip()
+    except (TypeError, KeyError, IndexError, AttributeError):
+        raise BackendError(f"Unexpected response ({status_code}): {body[:500]}")
+
+
+_backend: Optional[Backend] = None
+
+
+def get_backend() -> Backend:
+    """Get the backend used for all requests, creating the default if needed"""
+    global _backend
+    if _backend is None:
+        _backend = OpenAICompatibleBackend()
+    return _backend
+
+
+def set_backend(backend: Backend):
+    """Set the backend used for all requests"""
+    global _backend
+    if _backend is not None and _backend is not backend:
+        _backend.close()
+    _backend = backend
@@ -4,73 +4,549 @@ import logging
 import os
 import platform
 import re
+import sqlite3
+import sys
+import tarfile
+import time
+from functools import partial
 from pathlib import Path
+from typing import Optional
 
-from i_hate_papers.arxiv_utils import get_file_list, get_file_content
-from i_hate_papers.html_utils import process_html_content
-from i_hate_papers.latex_utils import process_latex_content
+from i_hate_papers.arxiv_utils import download_paper, get_file_list, get_file_content
+from i_hate_papers.bundle_utils import (
+    CATEGORIES,
+    BundleError,
+    export_bundle,
+    import_bundle,
+)
+from i_hate_papers.html_utils import process_html_content, render_markdown
+from i_hate_papers.latex_utils import (
+    process_latex_content,
+    extract_macros,
+    reduce_latex_content,
+)
+from i_hate_papers.llm_backends import (
+    OpenAICompatibleBackend,
+    RequestTimeout,
+    set_backend,
+)
 from i_hate_papers.markdown_utils import process_markdown_content
-from i_hate_papers.openai_utils import summarise_latex, extract_glossary
+from i_hate_papers.model_routing import (
+    AUTO_MODEL,
+    DEFAULT_MODEL_TIERS,
+    ModelTier,
+    ModelRouter,
+    UsageReport,
+    estimate_tokens,
+    load_model_tiers,
+)
+from i_hate_papers.openai_utils import (
+    summarise_latex,
+    extract_glossary,
+    summary_prompt,
+    GLOSSARY_PROMPT,
+    is_summary_cached,
+    is_glossary_cached,
+    derive_summary,
+    derive_prompt,
+    is_derived_summary_cached,
+    CONTENT_TOO_LARGE,
+)
+from i_hate_papers.pipeline import Pipeline, PipelineError
+from i_hate_papers.search_index import SearchIndex
+from i_hate_papers.scheduling import DeadlineScheduler
+from i_hate_papers.settings import API_BASE, API_TIMEOUT
+from i_hate_papers.similarity import SimilarityIndex
 
 logger = logging.getLogger(__name__)
 
 
 def main():
+    # Subcommands, i.e. 'i_hate_papers search lora'
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        return SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+
     # Argument parsing
     args = _parse_args()
 
     # Setup logging
     _setup_logging(verbosity=args.verbosity)
 
-    input_ = args.INPUT
+    # A single pooled backend is shared by every request in this run
+    set_backend(OpenAICompatibleBackend(base_url=args.api_base))
 
-    # Get the input file content, and some kind of file identifier
-    input_id, content_format, content = _get_input_content(
-        input_=input_,
-        no_input=args.no_input,
+    # Picks the model per request when using '--model auto'
+    router = ModelRouter(
+        tiers=load_model_tiers(args.model_tiers)
+        if args.model_tiers
+        else DEFAULT_MODEL_TIERS
     )
 
-    title, sections = _parse_input_content(
-        content=content,
-        content_format=content_format,
+    # Reuses summaries of near-identical sections, from this or any previous paper
+    similarity_index = None
+    if not args.no_similarity:
+        similarity_index = SimilarityIndex(threshold=args.similarity_threshold)
+
+    # Each paper is a set of tasks in the pipeline. Independent tasks run concurrently,
+    # so the next paper downloads while the current one is being summarised, and
+    # sections are summarised in parallel (up to --concurrency at a time)
+    pipeline = Pipeline(
+        max_workers=args.concurrency + NETWORK_CONCURRENCY + 1,
+        resource_limits={
+            "llm": args.concurrency,
+            "network": NETWORK_CONCURRENCY,
+            # Only one task may prompt the user at a time
+            "console": 1,
+        },
     )
+    # Every summary written is indexed for search, and so we can skip papers we've already done
+    search_index = SearchIndex()
+
+    for paper_index, input_ in enumerate(dict.fromkeys(args.INPUT)):
+        if not args.no_reuse and _reuse_existing_summaries(input_, args, search_index):
+            continue
+
+        _add_paper_tasks(
+            pipeline=pipeline,
+            input_=input_,
+            args=args,
+            router=router,
+            similarity_index=similarity_index,
+            search_index=search_index,
+            priority=paper_index * PAPER_PRIORITY_STEP,
+        )
+
+    if not pipeline.tasks:
+        return
 
-    # Summarise it
-    output_markdown = (
-        _summarise_content(
-            title=title,
-            sections=sections,
+    # A failure only stops the paper it belongs to, the others are still written
+    error = None
+    try:
+        pipeline.run()
+    except PipelineError as e:
+        error = e
+    logger.info(pipeline.report())
+
+    if similarity_index:
+        logger.info(
+            f"Reused {similarity_index.hits} of {similarity_index.lookups} uncached "
+            f"section summaries from similar sections (threshold {similarity_index.threshold})"
+        )
+
+    if error:
+        logger.error(str(error))
+        sys.exit(1)
+
+
+def _search(argv: list[str]):
+    """Search previously created summaries"""
+    parser = argparse.ArgumentParser(
+        prog="i_hate_papers search",
+        description="Search the summaries & glossaries of previously summarised papers",
+    )
+    parser.add_argument(
+        "QUERY",
+        help='Search query, using SQLite FTS5 syntax (example: lora AND "low rank")',
+    )
+    parser.add_argument("--limit", type=int, default=20, help="Max results to show")
+    parser.add_argument("--detail-level", type=int, choices=[0, 1, 2])
+    parser.add_argument("--model")
+    args = parser.parse_args(argv)
+
+    try:
+        results = SearchIndex().search(
+            args.QUERY,
+            limit=args.limit,
             detail_level=args.detail_level,
             model=args.model,
         )
-        + "\n\n"
+    except sqlite3.OperationalError as e:
+        sys.exit(f"Search failed: {e}")
+    for result in results:
+        print(
+            f"{result.paper_id}  d{result.detail_level}  {result.model}  {result.title}\n"
+            f"    {' '.join(result.snippet.split())}\n"
+            f"    {result.path}"
+        )
+    if not results:
+        print("No results")
+
+
+def _export(argv: list[str]):
+    """Export the cache to a bundle"""
+    parser = argparse.ArgumentParser(
+        prog="i_hate_papers export",
+        description=(
+            "Pack the cache into a single bundle, which can be imported on another machine\n"
+            "(i.e. to warm up a new worker) using 'i_hate_papers import'"
+        ),
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        default=Path("."),
+        help="Where to write the bundle. Default is the current directory",
+    )
+    parser.add_argument(
+        "--include",
+        nargs="+",
+        choices=CATEGORIES,
+        default=list(CATEGORIES),
+        help="What to include in the bundle. Default is everything",
+    )
+    parser.add_argument(
+        "--since",
+        type=Path,
+        help="A previous bundle. Only include what has changed since this bundle was created",
+    )
+    parser.add_argument("--verbosity", type=int, default=1, choices=[0, 1, 2])
+    args = parser.parse_args(argv)
+    _setup_logging(verbosity=args.verbosity)
+
+    try:
+        bundle_path = export_bundle(
+            output_dir=args.output_dir,
+            categories=tuple(args.include),
+            since=args.since,
+        )
+    except (BundleError, tarfile.TarError, OSError) as e:
+        sys.exit(f"Export failed: {e}")
+    if bundle_path:
+        print(bundle_path)
+
+
+def _import(argv: list[str]):
+    """Import bundles into the cache"""
+    parser = argparse.ArgumentParser(
+        prog="i_hate_papers import",
+        description="Import bundles created by 'i_hate_papers export' into the cache",
+    )
+    parser.add_argument(
+        "BUNDLE",
+        type=Path,
+        nargs="+",
+        help="Bundles to import. Give incremental bundles after the bundle they are based on",
+    )
+    parser.add_argument("--verbosity", type=int, default=1, choices=[0, 1, 2])
+    args = parser.parse_args(argv)
+    _setup_logging(verbosity=args.verbosity)
+
+    for bundle_path in args.BUNDLE:
+        try:
+            import_bundle(bundle_path)
+        except (BundleError, tarfile.TarError, OSError) as e:
+            sys.exit(f"Import of {bundle_path} failed: {e}")
+
+
+SUBCOMMANDS = {
+    "search": _search,
+    "export": _export,
+    "import": _import,
+}
+
+# Starts the metadata footer, which is different every time a summary is written
+FOOTER_HEADING = "# About this summary"
+
+SKIPPED_SECTION = "_Not summarised, the deadline was reached._"
+
+# Max number of concurrent downloads
+NETWORK_CONCURRENCY = 2
+# Tasks for earlier papers take priority over tasks for later papers
+PAPER_PRIORITY_STEP = 1_000
+
+
+def _reuse_existing_summaries(
+    input_: str, args: argparse.Namespace, search_index: SearchIndex
+) -> bool:
+    """Write out existing summaries of this paper, if we have them for every detail level"""
+    # Files may change, so only arXiv papers are reused
+    if not _is_arxiv_id(input_):
+        return False
+
+    variant = _output_variant(args)
+    existing = {
+        detail_level: search_index.get(input_, detail_level, args.model, variant)
+        for detail_level in args.detail_level
+    }
+    if not all(existing.values()):
+        return False
+
+    logger.info(f"Already summarised {input_}, reusing the existing summary")
+    for detail_level, output_markdown in existing.items():
+        _write_output(
+            output_markdown=output_markdown,
+            file_name=f"summary-{input_}-d{detail_level}-{args.model}",
+            make_html=not args.no_html,
+            open_html=not args.no_open,
+        )
+    return True
+
+
+def _output_variant(args: argparse.Namespace) -> str:
+    """Describe the options (other than model & detail level) which change the output
+
+    Summaries are only reused if they were created with the same options.
+    """
+    options = dict(
+        glossary=not args.no_glossary,
+        footer=not args.no_footer,
+        reduce=not args.no_reduce,
+        max_math_chars=args.max_math_chars,
+        # Summaries may include those of similar sections from other papers
+        similarity=not args.no_similarity,
+        similarity_threshold=args.similarity_threshold,
+    )
+    if args.model == AUTO_MODEL:
+        options["model_tiers"] = args.model_tiers
+    return ",".join(f"{k}={v}" for k, v in options.items())
+
+
+def _is_complete(
+    summary_markdown: str,
+    glossary_markdown: Optional[str],
+    args: argparse.Namespace,
+    scheduler: Optional[DeadlineScheduler],
+) -> bool:
+    """Is this a full summary, with nothing skipped or failed?"""
+    if scheduler and (scheduler.skipped or scheduler.degraded):
+        return False
+    if SKIPPED_SECTION in summary_markdown or CONTENT_TOO_LARGE in summary_markdown:
+        return False
+    if not args.no_glossary and (
+        not glossary_markdown or CONTENT_TOO_LARGE in glossary_markdown
+    ):
+        return False
+    return True
+
+
+def _add_paper_tasks(
+    pipeline: Pipeline,
+    input_: str,
+    args: argparse.Namespace,
+    router: ModelRouter,
+    similarity_index: Optional[SimilarityIndex],
+    search_index: SearchIndex,
+    priority: int,
+):
+    """Add the tasks needed to summarise a single paper to the pipeline"""
+    # The deadline covers the whole run, including downloading & parsing
+    scheduler = DeadlineScheduler(args.deadline) if args.deadline is not None else None
+
+    download_tasks = ()
+    if _is_arxiv_id(input_):
+        download_tasks = (
+            pipeline.add(
+                f"download:{input_}",
+                partial(download_paper, input_),
+                resource="network",
+                priority=priority,
+            ),
+        )
+
+    # Get the input file content, and some kind of file identifier
+    input_task = pipeline.add(
+        f"input:{input_}",
+        lambda *_: _get_input_content(input_=input_, no_input=args.no_input),
+        deps=download_tasks,
+        resource="console",
+        priority=priority,
+    )
+
+    def parse(input_content):
+        input_id, content_format, content = input_content
+
+        title, sections = _parse_input_content(
+            content=content,
+            content_format=content_format,
+        )
+
+        # Strip tables, long math, etc, to cut down on the tokens we send
+        reduction_report = []
+        if content_format == "latex" and not args.no_reduce:
+            sections, reduction_report = _reduce_latex_sections(
+                content=content,
+                sections=sections,
+                max_math_chars=args.max_math_chars,
+            )
+
+        # Now we know the sections, we can add the tasks to summarise them.
+        # Work on the most valuable sections first if we have a deadline to meet
+        section_titles = scheduler.order(list(sections)) if scheduler else sections
+
+        # Only the most detailed level is summarised from the source content. Each
+        # lower level is derived from the (much shorter) summary one level above it
+        detail_levels = sorted(set(args.detail_level), reverse=True)
+        derived_from = dict(zip(detail_levels[1:], detail_levels))
+        summary_tasks = {detail_level: {} for detail_level in detail_levels}
+        # Tracks cost & latency for each level's footer
+        usage = {detail_level: UsageReport() for detail_level in detail_levels}
+        for section_priority, section_title in enumerate(section_titles):
+            summary_tasks[detail_levels[0]][section_title] = pipeline.add(
+                f"summarise:{input_}:d{detail_levels[0]}:{section_title}",
+                partial(
+                    _summarise_scheduled_section,
+                    section_title=section_title,
+                    section_content=sections[section_title],
+                    detail_level=detail_levels[0],
+                    model=args.model,
+                    router=router,
+                    usage=usage[detail_levels[0]],
+                    similarity_index=similarity_index,
+                    scheduler=scheduler,
+                ),
+                resource="llm",
+                priority=priority + section_priority,
+            )
+
+            for detail_level in detail_levels[1:]:
+                summary_tasks[detail_level][section_title] = pipeline.add(
+                    f"derive:{input_}:d{detail_level}:{section_title}",
+                    partial(
+                        _derive_scheduled_section,
+                        section_title=section_title,
+                        detail_level=detail_level,
+                        model=args.model,
+                        router=router,
+                        usage=usage[detail_level],
+                        scheduler=scheduler,
+                    ),
+                    deps=(summary_tasks[derived_from[detail_level]][section_title],),
+                    resource="llm",
+                    priority=priority + section_priority,
+                )
+
+        for detail_level in detail_levels:
+            _add_output_tasks(
+                pipeline=pipeline,
+                input_=input_,
+                input_id=input_id,
+                title=title,
+                section_tasks={t: summary_tasks[detail_level][t] for t in sections},
+                detail_level=detail_level,
+                derived_from=derived_from.get(detail_level),
+                args=args,
+                router=router,
+                usage=usage[detail_level],
+                reduction_report=reduction_report,
+                scheduler=scheduler,
+                search_index=search_index,
+                priority=priority + len(sections),
+            )
+
+    pipeline.add(
+        f"parse:{input_}",
+        parse,
+        deps=(input_task,),
+        priority=priority,
+    )
+
+
+def _add_output_tasks(
+    pipeline: Pipeline,
+    input_: str,
+    input_id: str,
+    title: str,
+    section_tasks: dict[str, str],
+    detail_level: int,
+    derived_from: Optional[int],
+    args: argparse.Namespace,
+    router: ModelRouter,
+    usage: UsageReport,
+    reduction_report: list[tuple[str, int, int]],
+    scheduler: Optional[DeadlineScheduler],
+    search_index: SearchIndex,
+    priority: int,
+):
+    """Add the tasks to assemble, add a glossary to, and write out a summary"""
+
+    def assemble(*summaries):
+        return _assemble_summary(
+            title=title, summaries=dict(zip(section_tasks, summaries))
+        )
+
+    # Output sections in document order, regardless of the order they were summarised in
+    assemble_task = pipeline.add(
+        f"assemble:{input_}:d{detail_level}",
+        assemble,
+        deps=tuple(section_tasks.values()),
+        priority=priority,
     )
 
+    glossary_task = None
     if not args.no_glossary:
-        # Make a glossary from the summarised content
-        # TODO: The summarised content is sometimes not enough for the LLM to correctly
-        #       define a term. What would be better is to generate the list of words using
-        #       the summarised content, but then define the words using the original content.
-        #       However, the original content is often quite large, so passing that all at once to the
-        #       LLM may prove difficult without some intelligence.
-        output_markdown += (
-            _make_glossary(
-                content=output_markdown,
+
+        def glossary(summary_markdown):
+            # Glossaries have always been made from the summary plus a blank line,
+            # keep it that way so that cached glossaries are still used
+            return _make_scheduled_glossary(
+                content=summary_markdown + "\n\n",
                 model=args.model,
+                router=router,
+                usage=usage,
+                scheduler=scheduler,
             )
-            + "\n\n"
+
+        glossary_task = pipeline.add(
+            f"glossary:{input_}:d{detail_level}",
+            glossary,
+            deps=(assemble_task,),
+            resource="llm",
+            priority=priority,
         )
 
-    if not args.no_footer:
-        output_markdown += _make_metadata_footer(args) + "\n\n"
+    def write(summary_markdown, glossary_markdown=None):
+        output_markdown = summary_markdown + "\n\n"
+        if glossary_markdown:
+            output_markdown += glossary_markdown + "\n\n"
 
-    # Write the output
-    file_name = f"summary-{input_id}-d{args.detail_level}-{args.model}"
-    _write_output(
-        output_markdown=output_markdown,
-        file_name=file_name,
-        make_html=not args.no_html,
-        open_html=not args.no_open,
+        logger.info(
+            f"Made {len(usage.entries)} requests for {input_id} (detail level {detail_level}) in {usage.total_seconds:.1f}s, "
+            f"estimated cost ${usage.total_cost:.4f}"
+        )
+
+        if not args.no_footer:
+            output_markdown += (
+                _make_metadata_footer(
+                    args,
+                    detail_level=detail_level,
+                    derived_from=derived_from,
+                    usage=usage,
+                    reduction_report=reduction_report,
+                    scheduler=scheduler,
+                )
+                + "\n\n"
+            )
+
+        # Only complete summaries are indexed, as indexed summaries may be reused
+        complete = _is_complete(summary_markdown, glossary_markdown, args, scheduler)
+        if not complete:
+            logger.info(f"Summary of {input_id} is incomplete, it will not be indexed")
+
+        # Write the output
+        file_name = f"summary-{input_id}-d{detail_level}-{args.model}"
+        _write_output(
+            output_markdown=output_markdown,
+            file_name=file_name,
+            make_html=not args.no_html,
+            open_html=not args.no_open,
+            search_index=search_index if complete else None,
+            index_entry=dict(
+                paper_id=input_id,
+                detail_level=detail_level,
+                model=args.model,
+                variant=_output_variant(args),
+                title=title,
+                summary=summary_markdown,
+                glossary=glossary_markdown,
+            ),
+        )
+
+    pipeline.add(
+        f"write:{input_}:d{detail_level}",
+        write,
+        deps=(assemble_task, glossary_task) if glossary_task else (assemble_task,),
+        priority=priority,
     )
 
 
@@ -78,6 +554,8 @@ def _parse_args():
     parser = argparse.ArgumentParser(
         description=(
             "Summarise an academic paper\n\n"
+            "Use 'i_hate_papers search QUERY' to search previously created summaries, and\n"
+            "'i_hate_papers export' / 'i_hate_papers import' to copy the cache between machines\n\n"
             "You must set the OPENAI_API_KEY environment variable using your OpenAi.com API key"
         ),
         formatter_class=argparse.RawTextHelpFormatter,
@@ -85,7 +563,8 @@ def _parse_args():
 
     parser.add_argument(
         "INPUT",
-        help="arXiv paper ID (example: 1234.56789) or path to a .tex/.html/.md file",
+        nargs="+",
+        help="arXiv paper ID (example: 1234.56789) or path to a .tex/.html/.md file. May be given multiple times",
     )
     parser.add_argument(
         "--verbosity",
@@ -120,19 +599,107 @@ def _parse_args():
     parser.add_argument(
         "--detail-level",
         type=int,
-        default=1,
+        nargs="+",
+        default=[1],
         choices=[0, 1, 2],
-        help="How detailed should the summary be? (0 = minimal detail, 1 = normal, 2 = more detail)",
+        help=(
+            "How detailed should the summary be? (0 = minimal detail, 1 = normal, 2 = more detail)\n"
+            "Give several levels to create them all at once. Lower levels are derived from the most detailed summary"
+        ),
     )
     parser.add_argument(
         "--model",
         default="gpt-3.5-turbo-16k",
-        help="What model to use to generate the summaries",
+        help=(
+            "What model to use to generate the summaries.\n"
+            f"Use '{AUTO_MODEL}' to pick the cheapest adequate model for each section"
+        ),
+    )
+    parser.add_argument(
+        "--model-tiers",
+        type=Path,
+        help=(
+            f"JSON file listing the models '--model {AUTO_MODEL}' may choose from. A list of objects with the keys\n"
+            "model, context_tokens, prompt_price & completion_price (USD per 1k tokens)"
+        ),
+    )
+    parser.add_argument(
+        "--api-base",
+        default=API_BASE,
+        help=(
+            "Base URL of an OpenAI-compatible API. Use this to point at a locally hosted model.\n"
+            "Default is $OPENAI_API_BASE, or the OpenAI API if not set"
+        ),
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=_positive_int,
+        default=4,
+        help="How many requests to make to the model at once. Default is 4",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        metavar="SECONDS",
+        help=(
+            "Finish within this many seconds. The most important sections are summarised first,\n"
+            "detail is reduced as the deadline approaches, and anything left is skipped"
+        ),
+    )
+    parser.add_argument(
+        "--no-reuse",
+        action="store_true",
+        help="Summarise arXiv papers again, even if they have already been summarised",
+    )
+    parser.add_argument(
+        "--no-similarity",
+        action="store_true",
+        help="Don't reuse summaries of near-identical sections from previously summarised papers",
+    )
+    parser.add_argument(
+        "--similarity-threshold",
+        type=_fraction,
+        default=0.9,
+        help=(
+            "How similar (0-1, estimated Jaccard similarity) a section must be to a previously\n"
+            "summarised section for its summary to be reused. Default is 0.9"
+        ),
+    )
+    parser.add_argument(
+        "--no-reduce",
+        action="store_true",
+        help="Don't strip tables, diagrams, long math, etc. from latex before summarising",
+    )
+    parser.add_argument(
+        "--max-math-chars",
+        type=int,
+        default=80,
+        help="Math longer than this is replaced with a placeholder before summarising. Default is 80",
     )
     # TODO: No-cache parameter
     return parser.parse_args()
 
 
+def _positive_int(value: str) -> int:
+    try:
+        value = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"must be a whole number, not {value!r}")
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+    return value
+
+
+def _fraction(value: str) -> float:
+    try:
+        value = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"must be a number, not {value!r}")
+    if not 0 <= value <= 1:
+        raise argparse.ArgumentTypeError(f"must be between 0 and 1, not {value:g}")
+    return value
+
+
 def _setup_logging(verbosity):
     log_level = {
         0: logging.ERROR,
@@ -145,11 +712,15 @@ def _setup_logging(verbosity):
     )
 
 
+def _is_arxiv_id(input_: str) -> bool:
+    return bool(re.match(r"\d+\.\d+", input_))
+
+
 def _get_input_content(input_: str, no_input: bool) -> tuple[str, str, str]:
     # Get a list of source files for this paper from arXiv (or from a tex or md file)
 
     # If this isn't an arXiv then assume it is a path to a file
-    if not re.match(r"\d+\.\d+", input_):
+    if not _is_arxiv_id(input_):
         logger.debug(
             f"Input '{input_}' isn't an arXiv ID. Assuming it is a file, will read from disk"
         )
@@ -208,39 +779,275 @@ def _parse_input_content(
     return title, sections
 
 
-def _summarise_content(
-    title: str, sections: dict[str, str], detail_level: int, model: str
+def _reduce_latex_sections(
+    content: str, sections: dict[str, str], max_math_chars: int
+) -> tuple[dict[str, str], list[tuple[str, int, int]]]:
+    """Reduce the size of each latex section
+
+    Returns the reduced sections, plus a list of (section title, tokens before, tokens after)
+    """
+    macros = extract_macros(content)
+    logger.debug(f"Found {len(macros)} custom latex macros")
+
+    reduced_sections = {}
+    report = []
+    for section_title, section_content in sections.items():
+        reduced = reduce_latex_content(
+            section_content, macros=macros, max_math_chars=max_math_chars
+        )
+        before, after = estimate_tokens(section_content), estimate_tokens(reduced)
+        logger.debug(f"Reduced {section_title!r} from ~{before:,} to ~{after:,} tokens")
+        reduced_sections[section_title] = reduced
+        report.append((section_title, before, after))
+
+    total_before = sum(r[1] for r in report)
+    total_after = sum(r[2] for r in report)
+    logger.info(
+        f"Reduced input from ~{total_before:,} to ~{total_after:,} tokens "
+        f"(saving ~{total_before - total_after:,})"
+    )
+    return reduced_sections, report
+
+
+def _summarise_scheduled_section(
+    section_title: str,
+    section_content: str,
+    detail_level: int,
+    model: str,
+    router: ModelRouter,
+    usage: UsageReport,
+    similarity_index: SimilarityIndex = None,
+    scheduler: DeadlineScheduler = None,
+) -> str:
+    """Summarise a section, unless the deadline doesn't allow for it"""
+    if not scheduler:
+        logger.info(f"Summarising: {section_title}")
+        return _summarise_section(
+            section_title=section_title,
+            section_content=section_content,
+            detail_level=detail_level,
+            model=model,
+            router=router,
+            usage=usage,
+            similarity_index=similarity_index,
+        )
+
+    detail_level = scheduler.detail_level(section_title, detail_level)
+    if detail_level is None:
+        return SKIPPED_SECTION
+
+    logger.info(f"Summarising: {section_title}")
+    try:
+        return _summarise_section(
+            section_title=section_title,
+            section_content=section_content,
+            detail_level=detail_level,
+            model=model,
+            router=router,
+            usage=usage,
+            similarity_index=similarity_index,
+            timeout=scheduler.request_timeout(API_TIMEOUT),
+        )
+    except RequestTimeout:
+        scheduler.timed_out(section_title)
+        return SKIPPED_SECTION
+
+
+def _derive_scheduled_section(
+    summary: str,
+    section_title: str,
+    detail_level: int,
+    model: str,
+    router: ModelRouter,
+    usage: UsageReport,
+    scheduler: DeadlineScheduler = None,
 ) -> str:
-    """Summarise the content using ChatGPT"""
+    """Derive a less detailed summary of a section from a more detailed one"""
+    if summary in (SKIPPED_SECTION, CONTENT_TOO_LARGE):
+        return summary
+
+    name = f"{section_title} (d{detail_level})"
+    if scheduler and not scheduler.allow(name):
+        return SKIPPED_SECTION
 
-    logger.debug(f"Summarising {len(sections)} sections. {detail_level=}, {model=}")
+    prompt = derive_prompt(detail_level)
+    if model == AUTO_MODEL:
+        tier = router.choose(prompt + summary, section_title=section_title)
+        model = tier.model
+    else:
+        tier = router.tier_for(model)
 
+    logger.info(f"Deriving detail level {detail_level} summary: {section_title}")
+    cached = is_derived_summary_cached(summary, detail_level, model)
+    start = time.monotonic()
+    try:
+        derived = derive_summary(
+            summary,
+            detail_level=detail_level,
+            model=model,
+            timeout=scheduler.request_timeout(API_TIMEOUT) if scheduler else None,
+        )
+    except RequestTimeout:
+        if not scheduler:
+            raise
+        scheduler.timed_out(name)
+        return SKIPPED_SECTION
+    usage.record(
+        name=name,
+        model=model,
+        prompt=prompt + summary,
+        response=derived,
+        seconds=time.monotonic() - start,
+        cached=cached,
+        tier=tier,
+    )
+    return derived
+
+
+def _assemble_summary(title: str, summaries: dict[str, str]) -> str:
+    """Build the summary document from the (ordered) section summaries"""
     # Document title
     output_markdown = f"# {title}\n\n"
 
-    # Summarise each section into markdown
-    for section_title, section_content in sections.items():
-        logger.info(f"Summarising: {section_title}")
+    for section_title, summary in summaries.items():
         output_markdown += f"## {section_title}\n\n"
-        # This will call ChatGPT
-        output_markdown += (
-            summarise_latex(
-                content=section_content,
-                detail_level=detail_level,
+        output_markdown += summary + "\n\n"
+
+    return output_markdown.strip()
+
+
+def _summarise_section(
+    section_title: str,
+    section_content: str,
+    detail_level: int,
+    model: str,
+    router: ModelRouter,
+    usage: UsageReport,
+    similarity_index: SimilarityIndex = None,
+    timeout: float = None,
+) -> str:
+    if model != AUTO_MODEL:
+        return _summarise_with_model(
+            section_title=section_title,
+            section_content=section_content,
+            detail_level=detail_level,
+            model=model,
+            tier=router.tier_for(model),
+            usage=usage,
+            similarity_index=similarity_index,
+            timeout=timeout,
+        )
+
+    # Start with the cheapest model which should fit, and move up if it doesn't
+    prompt = summary_prompt(detail_level)
+    tier = router.choose(prompt + section_content, section_title=section_title)
+    while True:
+        fitted = router.fit_text(section_content, tier, prompt=prompt)
+        summary = _summarise_with_model(
+            section_title=section_title,
+            section_content=fitted,
+            detail_level=detail_level,
+            model=tier.model,
+            tier=tier,
+            usage=usage,
+            similarity_index=similarity_index,
+            timeout=timeout,
+            truncated=len(fitted) < len(section_content),
+        )
+        larger = router.next_tier(tier)
+        if summary != CONTENT_TOO_LARGE or not larger:
+            return summary
+        logger.info(f"Too large for {tier.model}, trying {larger.model}")
+        tier = larger
+
+
+def _summarise_with_model(
+    section_title: str,
+    section_content: str,
+    detail_level: int,
+    model: str,
+    tier: Optional[ModelTier],
+    usage: UsageReport,
+    similarity_index: SimilarityIndex = None,
+    timeout: float = None,
+    truncated: bool = False,
+) -> str:
+    prompt = summary_prompt(detail_level)
+    cached = is_summary_cached(section_content, detail_level, model)
+    start = time.monotonic()
+    # Summaries are only interchangeable if they were made by the same model & prompt
+    similarity_namespace = f"{model}:d{detail_level}"
+
+    if not cached and similarity_index:
+        match = similarity_index.find(section_content, similarity_namespace)
+        if match:
+            similarity, summary = match
+            logger.info(f"Reusing summary of similar content ({similarity:.0%})")
+            usage.record(
+                name=section_title,
                 model=model,
+                prompt=prompt + section_content,
+                response=summary,
+                seconds=time.monotonic() - start,
+                cached=True,
+                tier=tier,
+                similarity=similarity,
+                truncated=truncated,
             )
-            + "\n\n"
-        )
+            return summary
+
+    # This will call ChatGPT
+    summary = summarise_latex(
+        content=section_content,
+        detail_level=detail_level,
+        model=model,
+        timeout=timeout,
+    )
+    usage.record(
+        name=section_title,
+        model=model,
+        prompt=prompt + section_content,
+        response=summary,
+        seconds=time.monotonic() - start,
+        cached=cached,
+        tier=tier,
+        truncated=truncated,
+    )
 
-    logger.debug(f"Summarising complete")
+    if similarity_index and summary != CONTENT_TOO_LARGE:
+        similarity_index.add(section_content, similarity_namespace, summary)
 
-    return output_markdown.strip()
+    return summary
 
 
-def _make_glossary(content: str, model: str):
+def _make_glossary(
+    content: str,
+    model: str,
+    router: ModelRouter,
+    usage: UsageReport,
+    timeout: float = None,
+):
     """Generate a glossary as markdown"""
     logger.info(f"Creating glossary")
-    terms = extract_glossary(content, model=model)
+
+    if model == AUTO_MODEL:
+        tier = router.choose(GLOSSARY_PROMPT + content, section_title="Glossary")
+        model = tier.model
+    else:
+        tier = router.tier_for(model)
+
+    cached = is_glossary_cached(content, model)
+    start = time.monotonic()
+    terms = extract_glossary(content, model=model, timeout=timeout)
+    usage.record(
+        name="Glossary",
+        model=model,
+        prompt=GLOSSARY_PROMPT + content,
+        response=terms,
+        seconds=time.monotonic() - start,
+        cached=cached,
+        tier=tier,
+    )
 
     return (
         "## Glossary (Generated)\n\n"
@@ -248,26 +1055,110 @@ def _make_glossary(content: str, model: str):
     ) + terms
 
 
-def _make_metadata_footer(args):
-    footer = "# About this summary\n\n"
+def _make_scheduled_glossary(
+    content: str,
+    model: str,
+    router: ModelRouter,
+    usage: UsageReport,
+    scheduler: DeadlineScheduler = None,
+):
+    """Generate a glossary, unless the deadline doesn't allow for it"""
+    if scheduler and not scheduler.allow(
+        "Glossary", expected_seconds=usage.mean_request_seconds
+    ):
+        return None
+
+    # TODO: The summarised content is sometimes not enough for the LLM to correctly
+    #       define a term. What would be better is to generate the list of words using
+    #       the summarised content, but then define the words using the original content.
+    #       However, the original content is often quite large, so passing that all at once to the
+    #       LLM may prove difficult without some intelligence.
+    if not scheduler:
+        return _make_glossary(content=content, model=model, router=router, usage=usage)
+
+    try:
+        return _make_glossary(
+            content=content,
+            model=model,
+            router=router,
+            usage=usage,
+            timeout=scheduler.request_timeout(API_TIMEOUT),
+        )
+    except RequestTimeout:
+        scheduler.timed_out("Glossary")
+        return None
+
+
+def _make_metadata_footer(
+    args,
+    detail_level: int = None,
+    derived_from: int = None,
+    usage: UsageReport = None,
+    reduction_report: list[tuple[str, int, int]] = None,
+    scheduler: DeadlineScheduler = None,
+):
+    footer = f"{FOOTER_HEADING}\n\n"
     footer += "| Argument | Value |\n"
     footer += "| -- | -- |\n"
 
     metadata = args._get_kwargs()
 
     for name, value in metadata:
+        if name == "detail_level" and detail_level is not None:
+            # The level of this summary, rather than every level requested
+            value = detail_level
         footer += f"| {name} | {value} |\n"
     footer += "\n"
 
+    if derived_from is not None:
+        footer += (
+            f"This detail level {detail_level} summary was derived from the "
+            f"detail level {derived_from} summary, rather than from the paper itself.\n\n"
+        )
+
+    if usage and usage.entries:
+        footer += "## Models used\n\n"
+        footer += usage.as_markdown() + "\n\n"
+        if usage.similar_hits:
+            footer += f"{usage.similar_hits} section summaries were reused from similar sections.\n\n"
+        if usage.truncated:
+            footer += (
+                "These sections were too long for the model, and were truncated before "
+                f"being summarised: {', '.join(usage.truncated)}\n\n"
+            )
+
+    if scheduler:
+        footer += "## Deadline\n\n"
+        footer += scheduler.as_markdown() + "\n\n"
+
+    if reduction_report:
+        footer += "## Input reduction\n\n"
+        footer += "| Section | Est. tokens before | Est. tokens after | Saved |\n"
+        footer += "| -- | -- | -- | -- |\n"
+        for section_title, before, after in reduction_report:
+            footer += (
+                f"| {section_title} | {before:,} | {after:,} | {before - after:,} |\n"
+            )
+        footer += "\n"
+
     footer += f"Summary was created at `{datetime.now(timezone.utc).isoformat()}`\n\n"
 
     return footer.strip()
 
 
 def _write_output(
-    output_markdown: str, file_name: str, make_html: bool, open_html: bool
+    output_markdown: str,
+    file_name: str,
+    make_html: bool,
+    open_html: bool,
+    search_index: SearchIndex = None,
+    index_entry: dict = None,
 ):
-    """Write the output markdown to a file and render the HTML"""
+    """Write the output markdown to a file and render the HTML
+
+    If given, the summary is also added to the search index. `index_entry` holds the
+    remaining arguments for `SearchIndex.add()` (paper ID, detail level, etc)
+    """
     logger.debug(f"Writing output {file_name=}, {make_html=}, {open_html=}")
 
     # TODO: Add markdown footer with metadata
@@ -277,16 +1168,24 @@ def _write_output(
 
     logger.info(f"Written markdown to: {md_path}")
 
-    # Render HTML from markdown and write it out
-    if make_html:
-        import markdown
+    if search_index and index_entry:
+        search_index.add(markdown=output_markdown, path=md_path, **index_entry)
 
+    # Render HTML from markdown and write it out. Sections are rendered individually
+    # and cached, so unchanged sections don't need rendering again
+    if make_html:
         html_path = Path(f"{file_name}.html")
-        md = markdown.Markdown(
-            extensions=["mdx_math", "tables"],
-            extension_configs={"mdx_math": {"enable_dollar_delimiter": True}},
-        )
-        html_path.write_text(HTML % md.convert(output_markdown))
+        # The footer changes every time, so isn't worth caching
+        body, heading, footer = output_markdown.rpartition(f"\n{FOOTER_HEADING}\n")
+        if heading:
+            html = (
+                render_markdown(body)
+                + "\n"
+                + render_markdown(heading + footer, persist=False)
+            )
+        else:
+            html = render_markdown(output_markdown)
+        html_path.write_text(HTML % html)
         logger.info(f"Written HTML to: {html_path}")
         if open_html and platform.system() == "Darwin":
             os.system(f"open {html_path}")
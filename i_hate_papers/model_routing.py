@@ -0,0 +1,233 @@
+import json
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Pass this as the model name to pick a model per request
+AUTO_MODEL = "auto"
+
+
+@dataclass(frozen=True)
+class ModelTier:
+    model: str
+    # Total context size (prompt + completion)
+    context_tokens: int
+    # USD per 1,000 tokens
+    prompt_price: float = 0.0
+    completion_price: float = 0.0
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return (
+            prompt_tokens * self.prompt_price
+            + completion_tokens * self.completion_price
+        ) / 1000
+
+
+# Cheapest first
+DEFAULT_MODEL_TIERS = (
+    ModelTier("gpt-3.5-turbo", 4_096, 0.0015, 0.002),
+    ModelTier("gpt-3.5-turbo-16k", 16_384, 0.003, 0.004),
+    ModelTier("gpt-4-32k", 32_768, 0.06, 0.12),
+)
+
+# Sections which never need anything more than the cheapest model
+BOILERPLATE_SECTION_NAMES = (
+    "acknowledgement",
+    "acknowledgment",
+    "funding",
+    "author contribution",
+    "competing interest",
+    "ethics statement",
+    "reproducibility",
+    "references",
+)
+
+
+CHARS_PER_TOKEN = 4
+# Headroom when checking what will fit, as dense LaTeX has more tokens per char.
+# If a request still turns out to be too large, the next tier up is tried.
+TOKEN_MARGIN = 1.1
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate the number of tokens in the given text (~4 chars per token)"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def load_model_tiers(path: Path) -> tuple[ModelTier, ...]:
+    """Load model tiers from a JSON file
+
+    The file should contain a list of objects with the keys `model`, `context_tokens`,
+    and optionally `prompt_price` & `completion_price` (USD per 1k tokens).
+    """
+    tiers = [ModelTier(**t) for t in json.loads(Path(path).read_text("utf8"))]
+    return tuple(sorted(tiers, key=lambda t: (t.prompt_price, t.context_tokens)))
+
+
+class ModelRouter:
+    """Picks the cheapest adequate model for each request"""
+
+    def __init__(
+        self,
+        tiers: tuple[ModelTier, ...] = DEFAULT_MODEL_TIERS,
+        completion_tokens: int = 1_000,
+    ):
+        if not tiers:
+            raise ValueError("At least one model tier is required")
+        self.tiers = tiers
+        # Tokens to leave free for the model's response
+        self.completion_tokens = completion_tokens
+
+    def choose(self, text: str, section_title: str = "") -> ModelTier:
+        """Choose a model tier for the given prompt text"""
+        needed = int(estimate_tokens(text) * TOKEN_MARGIN) + self.completion_tokens
+
+        if is_boilerplate_section(section_title):
+            # Boilerplate is never worth a bigger model, it'll be truncated to fit instead
+            tier = self.tiers[0]
+        else:
+            fitting = [t for t in self.tiers if t.context_tokens >= needed]
+            # Nothing fits, so use the largest and hope for the best
+            tier = (
+                fitting[0]
+                if fitting
+                else max(self.tiers, key=lambda t: t.context_tokens)
+            )
+
+        logger.debug(f"Routing {section_title!r} to {tier.model}. {needed=}")
+        return tier
+
+    def fit_text(self, text: str, tier: ModelTier, prompt: str = "") -> str:
+        """Truncate the text so that it (and the prompt) will fit within the given tier's context"""
+        available = (
+            tier.context_tokens
+            - self.completion_tokens
+            - int(estimate_tokens(prompt) * TOKEN_MARGIN)
+        )
+        max_chars = int(max(available, 0) / TOKEN_MARGIN) * CHARS_PER_TOKEN
+        if len(text) <= max_chars:
+            return text
+        logger.debug(
+            f"Truncating {len(text):,} chars to {max_chars:,} for {tier.model}"
+        )
+        return text[:max_chars]
+
+    def next_tier(self, tier: ModelTier) -> Optional[ModelTier]:
+        """The cheapest tier with a larger context than the given one, if any"""
+        larger = [t for t in self.tiers if t.context_tokens > tier.context_tokens]
+        return larger[0] if larger else None
+
+    def tier_for(self, model: str) -> Optional[ModelTier]:
+        for tier in self.tiers:
+            if tier.model == model:
+                return tier
+        return None
+
+
+def is_boilerplate_section(section_title: str) -> bool:
+    section_title = section_title.lower()
+    return any(name in section_title for name in BOILERPLATE_SECTION_NAMES)
+
+
+@dataclass
+class UsageEntry:
+    name: str
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    seconds: float
+    cached: bool
+    # None if the model's price is unknown
+    cost: Optional[float]
+    # Set if the summary of similar content was reused
+    similarity: Optional[float] = None
+    # Set if the content was cut short to fit the model's context
+    truncated: bool = False
+
+
+@dataclass
+class UsageReport:
+    """Records which model handled each request, and what it cost"""
+
+    entries: list[UsageEntry] = field(default_factory=list)
+
+    def record(
+        self,
+        name: str,
+        model: str,
+        prompt: str,
+        response: str,
+        seconds: float,
+        cached: bool,
+        tier: Optional[ModelTier] = None,
+        similarity: Optional[float] = None,
+        truncated: bool = False,
+    ) -> UsageEntry:
+        prompt_tokens = estimate_tokens(prompt)
+        completion_tokens = estimate_tokens(response)
+        if cached:
+            cost = 0.0
+        elif tier:
+            cost = tier.cost(prompt_tokens, completion_tokens)
+        else:
+            cost = None
+
+        entry = UsageEntry(
+            name=name,
+            model=model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            seconds=seconds,
+            cached=cached,
+            cost=cost,
+            similarity=similarity,
+            truncated=truncated,
+        )
+        self.entries.append(entry)
+        return entry
+
+    @property
+    def total_cost(self) -> float:
+        return sum(e.cost or 0 for e in self.entries)
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(e.seconds for e in self.entries)
+
+    @property
+    def similar_hits(self) -> int:
+        return sum(1 for e in self.entries if e.similarity is not None)
+
+    @property
+    def truncated(self) -> list[str]:
+        """Names of the requests whose content was truncated"""
+        return [e.name for e in self.entries if e.truncated]
+
+    @property
+    def mean_request_seconds(self) -> float:
+        """Mean time taken by requests which weren't served from the cache"""
+        requests = [e.seconds for e in self.entries if not e.cached]
+        return sum(requests) / len(requests) if requests else 0.0
+
+    def as_markdown(self) -> str:
+        out = "| Request | Model | Est. tokens (in/out) | Seconds | Est. cost (USD) |\n"
+        out += "| -- | -- | -- | -- | -- |\n"
+        for e in self.entries:
+            if e.similarity is not None:
+                cost = f"similar ({e.similarity:.0%})"
+            elif e.cached:
+                cost = "cached"
+            elif e.cost is None:
+                cost = "unknown"
+            else:
+                cost = f"{e.cost:.4f}"
+            name = f"{e.name} (truncated)" if e.truncated else e.name
+            out += (
+                f"| {name} | {e.model} | {e.prompt_tokens:,}/{e.completion_tokens:,} "
+                f"| {e.seconds:.2f} | {cost} |\n"
+            )
+        out += f"| **Total** | | | {self.total_seconds:.2f} | {self.total_cost:.4f} |\n"
+        return out.strip()
@@ -1,18 +1,17 @@
 import logging
 from hashlib import sha1
+from typing import Optional
 
-import openai
-from openai import InvalidRequestError
-
+from i_hate_papers.llm_backends import Backend, ContextLengthExceeded, get_backend
 from i_hate_papers.settings import CACHE_DIR
 
 logger = logging.getLogger(__name__)
 
+CONTENT_TOO_LARGE = "Content too large, failed to summarise"
 
-def openai_request(question, text, temperature, model):
-    """Sends a request to a openai large language model."""
-    kwargs = dict(
-        model=model,
+
+def _request_kwargs(question, text, temperature):
+    return dict(
         messages=[
             # {"role": "system", "content": "You are a helpful assistant."},
             {"role": "user", "content": f"""{question}:\n\n{text}"""}
@@ -21,94 +20,185 @@ def openai_request(question, text, temperature, model):
         top_p=1.0,
         frequency_penalty=0.2,
         presence_penalty=0.0,
-        timeout=5,
     )
-    logger.debug(f"Calling ChatCompletion API: {kwargs=}")
-    try:
-        response = openai.ChatCompletion.create(**kwargs)
-        return response["choices"][0]["message"]["content"].strip()
-    except InvalidRequestError as e:
-        if e.error.code == "context_length_exceeded":
-            logger.error(f"Failed to summarise some content: {e.error.message}")
-            return "Content too large, failed to summarise"
-        else:
-            raise
 
 
-def summarise_latex(
-    content: str,
-    detail_level: int,
-    force=False,
-    model="gpt-3.5-turbo",
+def openai_request(
+    question, text, temperature, model, backend: Backend = None, timeout=None
 ):
-    detail_request = {
-        0: "Assume the reader has no grasp of the subject. Do not go into detail, simplify advanced terminology. ",
-        1: "Assume the reader has only a high-level understanding of the subject. ",
-        2: "Assume the reader has has a detailed understanding of the subject. Go into detail where necessary. ",
-    }[detail_level]
+    """Sends a request to a openai large language model."""
+    backend = backend or get_backend()
+    kwargs = _request_kwargs(question, text, temperature)
+    logger.debug(f"Calling ChatCompletion API: {model=} {kwargs=}")
+    try:
+        return backend.complete(model=model, timeout=timeout, **kwargs)
+    except ContextLengthExceeded as e:
+        logger.error(f"Failed to summarise some content: {e}")
+        return CONTENT_TOO_LARGE
+
+
+SUMMARY_TEMPERATURE = 0.3
+GLOSSARY_TEMPERATURE = 0
+
+GLOSSARY_PROMPT = (
+    f"Create a long & comprehensive glossary of unusual terminology given the following markdown-formatted content. "
+    f"Format results using markdown. Terms must be bold, term definitions must not be bold. "
+    f"Term definitions must be a single line. "
+    f"Do not include any introductory text or headings."
+)
+
+
+DETAIL_REQUESTS = {
+    0: "Assume the reader has no grasp of the subject. Do not go into detail, simplify advanced terminology. ",
+    1: "Assume the reader has only a high-level understanding of the subject. ",
+    2: "Assume the reader has has a detailed understanding of the subject. Go into detail where necessary. ",
+}
 
-    prompt = (
+
+def summary_prompt(detail_level: int) -> str:
+    detail_request = DETAIL_REQUESTS[detail_level]
+
+    return (
         f"Summarise the following section. "
         f"{detail_request} "
         f"Format your response using markdown syntax:"
     )
-    temperature = 0.3
 
+
+def derive_prompt(detail_level: int) -> str:
+    detail_request = DETAIL_REQUESTS[detail_level]
+
+    return (
+        f"Rewrite the following summary of a section of an academic paper so that it is shorter and less detailed. "
+        f"{detail_request} "
+        f"Format your response using markdown syntax:"
+    )
+
+
+def _cache_path(cache_name: str, prompt: str, content: str, temperature, model: str):
     cache_hash = sha1((prompt + content + str(temperature) + model).encode("utf8"))
-    cache_path = CACHE_DIR / "summaries" / cache_hash.hexdigest()
+    cache_path = CACHE_DIR / cache_name / cache_hash.hexdigest()
     cache_path.parent.mkdir(exist_ok=True, parents=True)
+    return cache_path
+
 
+def _read_cache(cache_path, force: bool) -> Optional[str]:
     if cache_path.exists() and not force:
-        logger.debug(f"Summary found in cache: {cache_path}")
+        logger.debug(f"Found in cache: {cache_path}")
         return cache_path.read_text("utf8")
 
     logger.debug(
-        f"Summary not found in cache. Will summarise and store in cache at: {cache_path}"
+        f"Not found in cache. Will request and store in cache at: {cache_path}"
     )
+    return None
+
+
+def is_summary_cached(content: str, detail_level: int, model: str) -> bool:
+    prompt = summary_prompt(detail_level)
+    return _cache_path(
+        "summaries", prompt, content, SUMMARY_TEMPERATURE, model
+    ).exists()
+
+
+def is_glossary_cached(content: str, model: str) -> bool:
+    return _cache_path(
+        "key-terms", GLOSSARY_PROMPT, content, GLOSSARY_TEMPERATURE, model
+    ).exists()
+
+
+def summarise_latex(
+    content: str,
+    detail_level: int,
+    force=False,
+    model="gpt-3.5-turbo",
+    backend: Backend = None,
+    timeout: float = None,
+):
+    prompt = summary_prompt(detail_level)
+    cache_path = _cache_path("summaries", prompt, content, SUMMARY_TEMPERATURE, model)
+    cached = _read_cache(cache_path, force)
+    if cached is not None:
+        return cached
+
     response = openai_request(
         prompt,
         content,
-        temperature=temperature,
+        temperature=SUMMARY_TEMPERATURE,
+        model=model,
+        backend=backend,
+        timeout=timeout,
+    )
+    cache_path.write_text(response, "utf8")
+    return response
+
+
+def derive_summary(
+    summary: str,
+    detail_level: int,
+    force=False,
+    model="gpt-3.5-turbo",
+    backend: Backend = None,
+    timeout: float = None,
+):
+    """Create a less detailed summary from an existing summary
+
+    This is much cheaper than summarising the original content again,
+    as the existing summary is far shorter.
+    """
+    prompt = derive_prompt(detail_level)
+    cache_path = _cache_path(
+        "derived-summaries", prompt, summary, SUMMARY_TEMPERATURE, model
+    )
+    cached = _read_cache(cache_path, force)
+    if cached is not None:
+        return cached
+
+    response = openai_request(
+        prompt,
+        summary,
+        temperature=SUMMARY_TEMPERATURE,
         model=model,
+        backend=backend,
+        timeout=timeout,
     )
     cache_path.write_text(response, "utf8")
     return response
 
 
+def is_derived_summary_cached(summary: str, detail_level: int, model: str) -> bool:
+    prompt = derive_prompt(detail_level)
+    return _cache_path(
+        "derived-summaries", prompt, summary, SUMMARY_TEMPERATURE, model
+    ).exists()
+
+
 def extract_glossary(
     content: str,
     force=False,
     model="gpt-3.5-turbo",
+    backend: Backend = None,
+    timeout: float = None,
 ):
     """Extract a glossary from the given content"""
-    prompt = (
-        f"Create a long & comprehensive glossary of unusual terminology given the following markdown-formatted content. "
-        f"Format results using markdown. Terms must be bold, term definitions must not be bold. "
-        f"Term definitions must be a single line. "
-        f"Do not include any introductory text or headings."
+    cache_path = _cache_path(
+        "key-terms", GLOSSARY_PROMPT, content, GLOSSARY_TEMPERATURE, model
     )
-    temperature = 0
-
-    cache_hash = sha1((prompt + content + str(temperature) + model).encode("utf8"))
-    cache_path = CACHE_DIR / "key-terms" / cache_hash.hexdigest()
-    cache_path.parent.mkdir(exist_ok=True, parents=True)
-
-    if cache_path.exists() and not force:
-        logger.debug(f"Key terms found in cache: {cache_path}")
-        markdown = cache_path.read_text("utf8")
-    else:
-        logger.debug(
-            f"Key terms not found in cache. Will summarise and store in cache at: {cache_path}"
-        )
-        response = openai_request(
-            prompt,
+    markdown = _read_cache(cache_path, force)
+    if markdown is None:
+        markdown = openai_request(
+            GLOSSARY_PROMPT,
             content,
-            temperature=temperature,
+            temperature=GLOSSARY_TEMPERATURE,
             model=model,
+            backend=backend,
+            timeout=timeout,
         )
-        cache_path.write_text(response, "utf8")
-        markdown = response
+        cache_path.write_text(markdown, "utf8")
+
+    return _format_glossary(markdown)
+
 
+def _format_glossary(markdown: str) -> str:
     lines = [m for m in markdown.splitlines() if m.strip() and not m.startswith("#")]
     sorted(lines)
     return "\n\n".join(lines)
@@ -0,0 +1,276 @@
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineError(Exception):
+    pass
+
+
+class Task:
+    """A unit of work in a `Pipeline`
+
+    The task's function is called with the results of its dependencies,
+    in the order the dependencies are listed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        deps: tuple[str, ...] = (),
+        resource: Optional[str] = None,
+        priority: int = 0,
+    ):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.resource = resource
+        # Lower numbers run first when several tasks are ready
+        self.priority = priority
+        # The task which added this one, if it was added while the pipeline was running
+        self.parent: Optional[str] = None
+        self.result: Any = None
+        # When all dependencies had finished, which may be well before the task
+        # started if it was waiting for a resource or worker
+        self.ready: Optional[float] = None
+        # The task whose completion freed up the slot this task was waiting for
+        self.freed_by: Optional[str] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+    @property
+    def wait(self) -> float:
+        if self.ready is None or self.started is None:
+            return 0.0
+        return self.started - self.ready
+
+    def __repr__(self):
+        return f"<Task {self.name}>"
+
+
+class Pipeline:
+    """Runs a DAG of tasks, running independent tasks concurrently
+
+    `resource_limits` caps how many tasks using each resource may run at
+    once (for example, the number of concurrent LLM requests). Tasks may
+    add further tasks while the pipeline is running, which is useful when
+    the shape of the work isn't known until some of it has been done
+    (i.e. we don't know the sections until the paper has been parsed).
+
+    If a task fails, everything which depends on it (or was added by it) is
+    skipped, but unrelated tasks carry on. The failures are raised as a
+    `PipelineError` once everything else has finished.
+    """
+
+    def __init__(self, max_workers: int = 8, resource_limits: dict[str, int] = None):
+        self.max_workers = max_workers
+        self.resource_limits = resource_limits or {}
+        self.tasks: dict[str, Task] = {}
+        # Task name to the exception it raised
+        self.failed: dict[str, Exception] = {}
+        # Task name to the name of the failed task which prevented it from running
+        self.skipped: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    def add(
+        self,
+        name: str,
+        func: Callable,
+        deps: tuple[str, ...] = (),
+        resource: Optional[str] = None,
+        priority: int = 0,
+    ) -> str:
+        """Add a task, returning its name for use in other tasks' dependencies"""
+        with self._lock:
+            if name in self.tasks:
+                raise PipelineError(f"Duplicate task name: {name}")
+            task = Task(
+                name=name, func=func, deps=deps, resource=resource, priority=priority
+            )
+            task.parent = getattr(self._local, "task", None)
+            self.tasks[name] = task
+        return name
+
+    def result(self, name: str) -> Any:
+        return self.tasks[name].result
+
+    def run(self) -> dict[str, Any]:
+        """Run all tasks, returning a dict of task name to result"""
+        self.started = time.monotonic()
+        done: set[str] = set()
+        running: dict = {}
+        in_use = {resource: 0 for resource in self.resource_limits}
+        # The last task to finish, so we know what freed up the slots for the next tasks
+        last_finished: Optional[Task] = None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                self._skip_dependants(done, running)
+                for task in self._ready_tasks(done, running, in_use):
+                    logger.debug(f"Starting task: {task.name}")
+                    if task.resource in in_use:
+                        in_use[task.resource] += 1
+                    task.started = time.monotonic()
+                    if last_finished and task.ready < last_finished.finished:
+                        task.freed_by = last_finished.name
+                    deps = [self.tasks[d].result for d in task.deps]
+                    running[executor.submit(self._run_task, task, deps)] = task
+
+                if not running:
+                    break
+
+                completed, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    task = running.pop(future)
+                    task.finished = time.monotonic()
+                    last_finished = task
+                    if task.resource in in_use:
+                        in_use[task.resource] -= 1
+
+                    try:
+                        task.result = future.result()
+                    except Exception as e:
+                        logger.exception(f"Task failed: {task.name}")
+                        self.failed[task.name] = e
+                        continue
+
+                    logger.debug(f"Finished task: {task.name} ({task.duration:.2f}s)")
+                    done.add(task.name)
+
+        self.finished = time.monotonic()
+
+        if self.failed:
+            failures = ", ".join(f"{n} ({e!r})" for n, e in self.failed.items())
+            raise PipelineError(
+                f"{len(self.failed)} tasks failed: {failures}. "
+                f"{len(self.skipped)} tasks which depended on them were skipped"
+            )
+
+        with self._lock:
+            not_run = [n for n in self.tasks if n not in done]
+        if not_run:
+            raise PipelineError(
+                f"Tasks could not run, their dependencies are missing or circular: {not_run}"
+            )
+
+        return {name: task.result for name, task in self.tasks.items()}
+
+    def _run_task(self, task: Task, deps: list):
+        self._local.task = task.name
+        try:
+            return task.func(*deps)
+        finally:
+            self._local.task = None
+
+    def _skip_dependants(self, done: set, running: dict):
+        """Skip tasks which can never run, because something they need failed"""
+        running_names = {t.name for t in running.values()}
+        with self._lock:
+            tasks = list(self.tasks.values())
+
+        changed = True
+        while changed:
+            changed = False
+            for task in tasks:
+                if (
+                    task.name in done
+                    or task.name in running_names
+                    or task.name in self.failed
+                    or task.name in self.skipped
+                ):
+                    continue
+                for name in (*task.deps, task.parent):
+                    if name in self.failed or name in self.skipped:
+                        cause = self.skipped.get(name, name)
+                        logger.debug(f"Skipping task {task.name}, {cause} failed")
+                        self.skipped[task.name] = cause
+                        changed = True
+                        break
+
+    def _ready_tasks(self, done: set, running: dict, in_use: dict) -> list[Task]:
+        running_names = {t.name for t in running.values()}
+        with self._lock:
+            candidates = [
+                t
+                for t in self.tasks.values()
+                if t.name not in done
+                and t.name not in running_names
+                and t.name not in self.failed
+                and t.name not in self.skipped
+                and all(d in done for d in t.deps)
+            ]
+
+        now = time.monotonic()
+        for task in candidates:
+            if task.ready is None:
+                task.ready = now
+
+        ready = []
+        slots = self.max_workers - len(running)
+        for task in sorted(candidates, key=lambda t: t.priority):
+            if len(ready) >= slots:
+                break
+            if task.resource in in_use:
+                if in_use[task.resource] >= self.resource_limits[task.resource]:
+                    continue
+                # Reserve the slot now, the caller increments the real count
+                in_use = {**in_use, task.resource: in_use[task.resource] + 1}
+            ready.append(task)
+        return ready
+
+    def critical_path(self) -> list[Task]:
+        """The chain of dependent tasks which determined the total run time
+
+        A task's predecessor is whichever finished last of its dependencies, the
+        task which added it, and (if it had to wait for a slot) the task which
+        freed that slot.
+        """
+        finished = [t for t in self.tasks.values() if t.finished is not None]
+        if not finished:
+            return []
+
+        path = [max(finished, key=lambda t: t.finished)]
+        while True:
+            previous = list(path[-1].deps)
+            if path[-1].parent:
+                previous.append(path[-1].parent)
+            if path[-1].freed_by:
+                previous.append(path[-1].freed_by)
+            if not previous:
+                break
+            path.append(
+                max((self.tasks[d] for d in previous), key=lambda t: t.finished)
+            )
+        return list(reversed(path))
+
+    def report(self) -> str:
+        """Describe the critical path of the last run"""
+        wall_time = (self.finished or 0) - (self.started or 0)
+        busy_time = sum(t.duration for t in self.tasks.values())
+        out = (
+            f"Ran {len(self.tasks)} tasks in {wall_time:.2f}s "
+            f"({busy_time:.2f}s of work, {busy_time / wall_time if wall_time else 0:.1f}x concurrency)\n"
+            f"Critical path:\n"
+        )
+        for task in self.critical_path():
+            out += f"    {task.duration:8.2f}s  {task.name}"
+            if task.wait >= 0.01:
+                out += f" (waited {task.wait:.2f}s)"
+            out += "\n"
+        if self.failed:
+            out += f"Failed: {', '.join(self.failed)}\n"
+        return out.rstrip()
@@ -0,0 +1,107 @@
+import logging
+import time
+from typing import Optional
+
+from i_hate_papers.markdown_utils import COMMON_SECTION_NAMES
+
+logger = logging.getLogger(__name__)
+
+# Summarised first when working to a deadline, in this order
+HIGH_VALUE_SECTION_NAMES = ("abstract", "introduction", "conclusion")
+
+
+def section_priority(section_title: str) -> int:
+    """Lower numbers are more important
+
+    High value sections come first, then the remaining common sections
+    (methods, results, etc), then anything we don't recognise.
+    Acknowledgements are always last.
+    """
+    section_title = section_title.lower()
+    if "acknowledgement" in section_title or "acknowledgment" in section_title:
+        return len(HIGH_VALUE_SECTION_NAMES) + len(COMMON_SECTION_NAMES) + 1
+
+    for i, name in enumerate(HIGH_VALUE_SECTION_NAMES):
+        if name in section_title:
+            return i
+
+    for i, name in enumerate(COMMON_SECTION_NAMES):
+        if name in section_title:
+            return len(HIGH_VALUE_SECTION_NAMES) + i
+
+    return len(HIGH_VALUE_SECTION_NAMES) + len(COMMON_SECTION_NAMES)
+
+
+class DeadlineScheduler:
+    """Decides what to work on, and in how much detail, given a time budget
+
+    Sections are handed out most valuable first. Once less than `degrade_at`
+    of the budget remains the detail level is lowered (shorter responses come
+    back faster), and once the budget is spent everything else is skipped.
+    """
+
+    def __init__(self, seconds: float, degrade_at: float = 0.5, clock=time.monotonic):
+        self.seconds = seconds
+        self.degrade_at = degrade_at
+        self.clock = clock
+        self.started = clock()
+        # Names of work which was skipped or done at a lower detail level
+        self.skipped: list[str] = []
+        self.degraded: list[str] = []
+
+    @property
+    def remaining(self) -> float:
+        return max(self.seconds - (self.clock() - self.started), 0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining <= 0
+
+    def order(self, section_titles: list[str]) -> list[str]:
+        # sorted() is stable, so document order is kept within each priority
+        return sorted(section_titles, key=section_priority)
+
+    def detail_level(self, name: str, requested: int) -> Optional[int]:
+        """Get the detail level to use, or None if this work should be skipped"""
+        if self.expired:
+            logger.info(f"Deadline reached, skipping: {name}")
+            self.skipped.append(name)
+            return None
+
+        if requested > 0 and self.remaining < self.seconds * self.degrade_at:
+            logger.info(f"Deadline approaching, lowering detail level for: {name}")
+            self.degraded.append(name)
+            return requested - 1
+
+        return requested
+
+    def allow(self, name: str, expected_seconds: float = 0) -> bool:
+        """Should we start work which is expected to take the given time?"""
+        if self.remaining <= expected_seconds:
+            logger.info(f"Not enough time remaining, skipping: {name}")
+            self.skipped.append(name)
+            return False
+        return True
+
+    def request_timeout(self, default: float) -> float:
+        """Get the timeout for a request, so it can't run past the deadline"""
+        # requests does not accept a timeout of zero
+        return max(min(default, self.remaining), 0.01)
+
+    def timed_out(self, name: str):
+        """Record that a request was cut short by the deadline"""
+        logger.info(f"Deadline reached while waiting for a response, skipping: {name}")
+        self.skipped.append(name)
+        if name in self.degraded:
+            self.degraded.remove(name)
+
+    def as_markdown(self) -> str:
+        if not self.skipped and not self.degraded:
+            return f"Completed in full within the {self.seconds:g}s deadline."
+
+        out = f"Not all content could be summarised in full within the {self.seconds:g}s deadline.\n\n"
+        if self.skipped:
+            out += "Skipped: " + ", ".join(self.skipped) + "\n\n"
+        if self.degraded:
+            out += "Summarised in less detail: " + ", ".join(self.degraded) + "\n\n"
+        return out.strip()
@@ -0,0 +1,223 @@
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from i_hate_papers.settings import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SearchResult:
+    paper_id: str
+    detail_level: int
+    model: str
+    title: str
+    path: str
+    created: str
+    snippet: str = ""
+
+
+class SearchIndex:
+    """A full-text index of every summary we have written (uses SQLite FTS5)
+
+    Summaries are keyed by paper ID, detail level, model and variant (the other
+    options which affect the output), so the index also acts as a fast lookup
+    for summaries which have already been created.
+    """
+
+    def __init__(self, path: Path = CACHE_DIR / "search.sqlite3"):
+        self.path = path
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS summaries (
+                    id INTEGER PRIMARY KEY,
+                    paper_id TEXT NOT NULL,
+                    detail_level INTEGER NOT NULL,
+                    model TEXT NOT NULL,
+                    variant TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    created TEXT NOT NULL,
+                    markdown TEXT NOT NULL,
+                    UNIQUE (paper_id, detail_level, model, variant)
+                );
+                -- The rowid of each entry matches the id in the summaries table
+                CREATE VIRTUAL TABLE IF NOT EXISTS summaries_fts USING fts5(
+                    title,
+                    summary,
+                    glossary
+                );
+                """
+            )
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def add(
+        self,
+        paper_id: str,
+        detail_level: int,
+        model: str,
+        title: str,
+        summary: str,
+        glossary: str,
+        markdown: str,
+        path: Path,
+        variant: str = "",
+    ):
+        """Add a summary to the index, replacing any previous version"""
+        logger.debug(
+            f"Indexing summary. {paper_id=} {detail_level=} {model=} {variant=}"
+        )
+        with self._lock, self._connect() as db:
+            row = db.execute(
+                "SELECT id FROM summaries "
+                "WHERE paper_id = ? AND detail_level = ? AND model = ? AND variant = ?",
+                (paper_id, detail_level, model, variant),
+            ).fetchone()
+            if row:
+                db.execute("DELETE FROM summaries WHERE id = ?", row)
+                db.execute("DELETE FROM summaries_fts WHERE rowid = ?", row)
+
+            cursor = db.execute(
+                "INSERT INTO summaries "
+                "(paper_id, detail_level, model, variant, title, path, created, markdown) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    paper_id,
+                    detail_level,
+                    model,
+                    variant,
+                    title,
+                    str(Path(path).absolute()),
+                    datetime.now(timezone.utc).isoformat(),
+                    markdown,
+                ),
+            )
+            db.execute(
+                "INSERT INTO summaries_fts (rowid, title, summary, glossary) VALUES (?, ?, ?, ?)",
+                (cursor.lastrowid, title, summary, glossary or ""),
+            )
+
+    def merge_from(self, path: Path):
+        """Add summaries from another search index (i.e. from a cache bundle)
+
+        Summaries we already have are kept as they are.
+        """
+        with self._lock, self._connect() as db:
+            db.execute("ATTACH DATABASE ? AS other", (str(path),))
+            rows = db.execute(
+                """
+                SELECT s.paper_id, s.detail_level, s.model, s.variant, s.title, s.path,
+                       s.created, s.markdown, f.summary, f.glossary
+                FROM other.summaries s
+                JOIN other.summaries_fts f ON f.rowid = s.id
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM main.summaries m
+                    WHERE m.paper_id = s.paper_id
+                    AND m.detail_level = s.detail_level
+                    AND m.model = s.model
+                    AND m.variant = s.variant
+                )
+                """
+            ).fetchall()
+
+            for *entry, summary, glossary in rows:
+                cursor = db.execute(
+                    "INSERT INTO main.summaries "
+                    "(paper_id, detail_level, model, variant, title, path, created, markdown) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    entry,
+                )
+                db.execute(
+                    "INSERT INTO main.summaries_fts (rowid, title, summary, glossary) "
+                    "VALUES (?, ?, ?, ?)",
+                    (cursor.lastrowid, entry[4], summary, glossary),
+                )
+
+        logger.debug(f"Merged {len(rows)} summaries into the search index")
+
+    def get(
+        self, paper_id: str, detail_level: int, model: str, variant: str = ""
+    ) -> Optional[str]:
+        """Get the markdown of an existing summary, if there is one"""
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT markdown FROM summaries "
+                "WHERE paper_id = ? AND detail_level = ? AND model = ? AND variant = ?",
+                (paper_id, detail_level, model, variant),
+            ).fetchone()
+        return row[0] if row else None
+
+    def search(
+        self,
+        query: str,
+        limit: int = 20,
+        detail_level: int = None,
+        model: str = None,
+    ) -> list[SearchResult]:
+        """Search summaries & glossaries, best matches first
+
+        `query` uses the FTS5 query syntax, i.e. `lora AND "low rank"`. If the query
+        isn't valid FTS5 syntax (i.e. `low-rank`), each word is searched for as-is.
+        """
+        sql = (
+            "SELECT s.paper_id, s.detail_level, s.model, s.title, s.path, s.created, "
+            "snippet(summaries_fts, -1, '**', '**', '...', 12) "
+            "FROM summaries_fts JOIN summaries s ON s.id = summaries_fts.rowid "
+            "WHERE summaries_fts MATCH ?"
+        )
+        params = [query]
+        if detail_level is not None:
+            sql += " AND s.detail_level = ?"
+            params.append(detail_level)
+        if model is not None:
+            sql += " AND s.model = ?"
+            params.append(model)
+        sql += " ORDER BY summaries_fts.rank LIMIT ?"
+        params.append(limit)
+
+        with self._connect() as db:
+            try:
+                rows = db.execute(sql, params).fetchall()
+            except sqlite3.OperationalError as e:
+                logger.debug(
+                    f"Invalid query {query!r} ({e}), searching for words as-is"
+                )
+                params[0] = quote_query(query)
+                rows = db.execute(sql, params).fetchall()
+
+        return [
+            SearchResult(
+                paper_id=paper_id,
+                detail_level=int(detail_level),
+                model=model,
+                title=title,
+                path=path,
+                created=created,
+                snippet=snippet,
+            )
+            for paper_id, detail_level, model, title, path, created, snippet in rows
+        ]
+
+
+def quote_query(query: str) -> str:
+    """Quote each word of the query, so FTS5 won't treat any of it as syntax"""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
@@ -5,3 +5,9 @@ if _dir := os.environ.get("I_HATE_PAPERS_CACHE_DIR"):
     CACHE_DIR = Path(_dir)
 else:
     CACHE_DIR = Path("~/.cache").expanduser() / "i-hate-papers"
+
+# Any OpenAI-compatible API may be used, including locally hosted models
+API_BASE = os.environ.get("OPENAI_API_BASE", "https://api.openai.com/v1")
+API_KEY = os.environ.get("OPENAI_API_KEY")
+API_TIMEOUT = float(os.environ.get("I_HATE_PAPERS_API_TIMEOUT", "600"))
+API_POOL_SIZE = int(os.environ.get("I_HATE_PAPERS_API_POOL_SIZE", "10"))
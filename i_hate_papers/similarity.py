@@ -0,0 +1,206 @@
+import logging
+import re
+import sqlite3
+import struct
+import threading
+from contextlib import contextmanager
+from hashlib import blake2b, sha1
+from pathlib import Path
+from typing import Optional
+
+from i_hate_papers.settings import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# A Mersenne prime, larger than any 32 bit hash
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def normalise_text(text: str) -> str:
+    """Normalise text so trivial differences (formatting, commands, case) don't matter"""
+    text = re.sub(r"\\[a-zA-Z]+\*?", " ", text)
+    text = re.sub(r"[^a-zA-Z0-9]+", " ", text)
+    return text.lower().strip()
+
+
+def shingles(text: str, size: int = 5) -> set[str]:
+    words = normalise_text(text).split()
+    return {" ".join(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    """Creates MinHash signatures, where matching values estimate Jaccard similarity"""
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        self.num_perm = num_perm
+        # Parameters for the hash functions (a * x + b) % prime
+        params = []
+        for i in range(num_perm):
+            digest = blake2b(f"{seed}:{i}".encode("utf8"), digest_size=16).digest()
+            a, b = struct.unpack("<QQ", digest)
+            params.append((a % (_PRIME - 1) + 1, b % _PRIME))
+        self.params = params
+
+    def signature(self, shingle_set: set[str]) -> tuple[int, ...]:
+        hashes = [
+            struct.unpack("<I", blake2b(s.encode("utf8"), digest_size=4).digest())[0]
+            for s in shingle_set
+        ]
+        if not hashes:
+            return tuple([_MAX_HASH] * self.num_perm)
+        return tuple(
+            min(((a * h + b) % _PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self.params
+        )
+
+
+def estimate_similarity(sig1: tuple[int, ...], sig2: tuple[int, ...]) -> float:
+    return sum(1 for a, b in zip(sig1, sig2) if a == b) / len(sig1)
+
+
+class SimilarityIndex:
+    """Finds previous summaries of near-identical content
+
+    An LSH index over MinHash signatures of each summarised section. Signatures
+    are split into bands, and any previous section sharing a band with the new
+    section is a candidate match. Candidates are then compared using their full
+    signatures, and the best match above `threshold` is returned.
+
+    Entries are grouped into namespaces (i.e. model & detail level), as a summary is
+    only reusable if it was created in the same way.
+    """
+
+    def __init__(
+        self,
+        path: Path = CACHE_DIR / "similarity.sqlite3",
+        threshold: float = 0.9,
+        num_perm: int = 128,
+        bands: int = 32,
+        min_shingles: int = 20,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        if not 0 <= threshold <= 1:
+            raise ValueError("threshold must be between 0 and 1")
+
+        self.path = path
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        # Very short content gives unreliable matches
+        self.min_shingles = min_shingles
+        self.hasher = MinHasher(num_perm=num_perm)
+        self.lookups = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    namespace TEXT NOT NULL,
+                    signature BLOB NOT NULL,
+                    summary TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS buckets (
+                    namespace TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    PRIMARY KEY (namespace, bucket, key)
+                );
+                """
+            )
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _signature(self, content: str) -> Optional[tuple[int, ...]]:
+        shingle_set = shingles(content)
+        if len(shingle_set) < self.min_shingles:
+            return None
+        return self.hasher.signature(shingle_set)
+
+    def _buckets(self, signature: tuple[int, ...]) -> list[str]:
+        return [
+            f"{band}:"
+            + sha1(
+                struct.pack(
+                    f"<{self.rows}I",
+                    *signature[band * self.rows : (band + 1) * self.rows],
+                )
+            ).hexdigest()[:16]
+            for band in range(self.bands)
+        ]
+
+    def find(self, content: str, namespace: str) -> Optional[tuple[float, str]]:
+        """Find the summary of the most similar content, returning (similarity, summary)"""
+        signature = self._signature(content)
+        if signature is None:
+            return None
+
+        buckets = self._buckets(signature)
+        with self._connect() as db:
+            rows = db.execute(
+                f"""
+                SELECT DISTINCT e.signature, e.summary FROM buckets b
+                JOIN entries e ON e.key = b.key
+                WHERE b.namespace = ? AND b.bucket IN ({",".join("?" * len(buckets))})
+                """,
+                (namespace, *buckets),
+            ).fetchall()
+
+        best = None
+        for packed, summary in rows:
+            similarity = estimate_similarity(signature, _unpack(packed))
+            if similarity >= self.threshold and (not best or similarity > best[0]):
+                best = (similarity, summary)
+
+        with self._lock:
+            self.lookups += 1
+            if best:
+                self.hits += 1
+
+        if best:
+            logger.debug(f"Found similar content. similarity={best[0]:.2f}")
+        return best
+
+    def add(self, content: str, namespace: str, summary: str):
+        signature = self._signature(content)
+        if signature is None:
+            return
+
+        key = sha1((namespace + content).encode("utf8")).hexdigest()
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (key, namespace, _pack(signature), summary),
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO buckets VALUES (?, ?, ?)",
+                [(namespace, bucket, key) for bucket in self._buckets(signature)],
+            )
+
+    def merge_from(self, path: Path):
+        """Add all entries from another similarity index (i.e. from a cache bundle)"""
+        with self._lock, self._connect() as db:
+            db.execute("ATTACH DATABASE ? AS other", (str(path),))
+            db.execute("INSERT OR IGNORE INTO entries SELECT * FROM other.entries")
+            db.execute("INSERT OR IGNORE INTO buckets SELECT * FROM other.buckets")
+
+
+def _pack(signature: tuple[int, ...]) -> bytes:
+    return struct.pack(f"<{len(signature)}I", *signature)
+
+
+def _unpack(packed: bytes) -> tuple[int, ...]:
+    return struct.unpack(f"<{len(packed) // 4}I", packed)
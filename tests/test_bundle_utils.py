@@ -0,0 +1,122 @@
+import io
+import json
+import tarfile
+import tempfile
+import unittest
+from pathlib import Path
+
+from i_hate_papers.bundle_utils import (
+    BundleError,
+    _object_name,
+    export_bundle,
+    import_bundle,
+    read_manifest,
+)
+
+
+class BundleTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+        self.cache_dir = self.tmp / "cache"
+        self.output_dir = self.tmp / "bundles"
+        self.new_cache_dir = self.tmp / "new-cache"
+
+        (self.cache_dir / "summaries").mkdir(parents=True)
+        (self.cache_dir / "key-terms").mkdir()
+        (self.cache_dir / "summaries" / "a").write_text("Summary A")
+        (self.cache_dir / "summaries" / "b").write_text("Summary B")
+        (self.cache_dir / "key-terms" / "c").write_text("**Term** definition")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def export(self, **kwargs):
+        return export_bundle(
+            output_dir=self.output_dir,
+            categories=("summaries", "key-terms"),
+            cache_dir=self.cache_dir,
+            **kwargs,
+        )
+
+    def test_round_trip(self):
+        bundle_path = self.export()
+        stats = import_bundle(bundle_path, cache_dir=self.new_cache_dir)
+
+        self.assertEqual(stats["imported"], 3)
+        self.assertEqual(
+            (self.new_cache_dir / "summaries" / "a").read_text(), "Summary A"
+        )
+        self.assertEqual(
+            (self.new_cache_dir / "key-terms" / "c").read_text(), "**Term** definition"
+        )
+
+        # Importing again finds everything already present
+        stats = import_bundle(bundle_path, cache_dir=self.new_cache_dir)
+        self.assertEqual(stats["skipped"], 3)
+
+    def test_same_content_same_id(self):
+        first = read_manifest(self.export())["id"]
+        second = read_manifest(self.export())["id"]
+        self.assertEqual(first, second)
+
+    def test_since(self):
+        base = self.export()
+        self.assertIsNone(self.export(since=base))
+
+        (self.cache_dir / "summaries" / "b").write_text("Summary B, changed")
+        manifest = read_manifest(self.export(since=base))
+        self.assertEqual(list(manifest["files"]), ["summaries/b"])
+        self.assertEqual(manifest["base"], read_manifest(base)["id"])
+
+    def test_corrupt_object(self):
+        bundle_path = self.export()
+        manifest = read_manifest(bundle_path)
+        digest = manifest["files"]["summaries/a"]
+
+        # Rewrite the bundle with different content for one object
+        corrupt_path = self.tmp / "corrupt.tar.gz"
+        with tarfile.open(bundle_path) as source, tarfile.open(
+            corrupt_path, "w:gz"
+        ) as target:
+            for member in source.getmembers():
+                content = source.extractfile(member).read()
+                if member.name == _object_name(digest):
+                    content = b"Not summary A"
+                member.size = len(content)
+                target.addfile(member, io.BytesIO(content))
+
+        with self.assertRaises(BundleError):
+            import_bundle(corrupt_path, cache_dir=self.new_cache_dir)
+        # Nothing is written unless the whole bundle is intact
+        self.assertFalse((self.new_cache_dir / "summaries").exists())
+
+    def test_tampered_manifest(self):
+        bundle_path = self.export()
+        manifest = read_manifest(bundle_path)
+        manifest["files"]["summaries/evil"] = manifest["files"]["summaries/a"]
+
+        tampered_path = self.tmp / "tampered.tar.gz"
+        with tarfile.open(bundle_path) as source, tarfile.open(
+            tampered_path, "w:gz"
+        ) as target:
+            for member in source.getmembers():
+                content = source.extractfile(member).read()
+                if member.name == "manifest.json":
+                    content = json.dumps(manifest).encode("utf8")
+                member.size = len(content)
+                target.addfile(member, io.BytesIO(content))
+
+        with self.assertRaises(BundleError):
+            import_bundle(tampered_path, cache_dir=self.new_cache_dir)
+
+    def test_not_a_bundle(self):
+        path = self.tmp / "paper.tex"
+        path.write_text("\\section{Introduction}")
+
+        with self.assertRaises(BundleError):
+            import_bundle(path, cache_dir=self.new_cache_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import threading
+import time
+import unittest
+
+from i_hate_papers.pipeline import Pipeline, PipelineError
+
+
+class PipelineTestCase(unittest.TestCase):
+    def test_results_passed_in_dependency_order(self):
+        pipeline = Pipeline()
+        a = pipeline.add("a", lambda: 1)
+        b = pipeline.add("b", lambda: 2)
+        pipeline.add("sum", lambda x, y: (x, y), deps=(b, a))
+
+        results = pipeline.run()
+
+        self.assertEqual(results["sum"], (2, 1))
+
+    def test_tasks_added_while_running(self):
+        pipeline = Pipeline()
+
+        def parse():
+            child = pipeline.add("child", lambda: "child result")
+            pipeline.add("write", lambda result: result.upper(), deps=(child,))
+
+        pipeline.add("parse", parse)
+        results = pipeline.run()
+
+        self.assertEqual(results["write"], "CHILD RESULT")
+        self.assertEqual(pipeline.tasks["child"].parent, "parse")
+
+    def test_resource_limit(self):
+        pipeline = Pipeline(max_workers=8, resource_limits={"llm": 2})
+        lock = threading.Lock()
+        running = []
+        max_running = []
+
+        def task():
+            with lock:
+                running.append(1)
+                max_running.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+
+        for i in range(6):
+            pipeline.add(f"task{i}", task, resource="llm")
+        pipeline.run()
+
+        self.assertEqual(max(max_running), 2)
+
+    def test_failure_only_skips_dependants(self):
+        pipeline = Pipeline()
+
+        def fail():
+            raise ValueError("Failed to download")
+
+        failed = pipeline.add("download:1", fail)
+        pipeline.add("parse:1", lambda _: None, deps=(failed,))
+        pipeline.add("write:1", lambda _: None, deps=("parse:1",))
+        ok = pipeline.add("download:2", lambda: "content")
+        pipeline.add("write:2", lambda content: content, deps=(ok,))
+
+        with self.assertRaises(PipelineError) as cm:
+            pipeline.run()
+
+        self.assertIn("download:1", str(cm.exception))
+        self.assertEqual(list(pipeline.failed), ["download:1"])
+        self.assertEqual(
+            pipeline.skipped, {"parse:1": "download:1", "write:1": "download:1"}
+        )
+        self.assertEqual(pipeline.result("write:2"), "content")
+
+    def test_missing_dependency(self):
+        pipeline = Pipeline()
+        pipeline.add("write", lambda _: None, deps=("missing",))
+
+        with self.assertRaises(PipelineError):
+            pipeline.run()
+
+    def test_duplicate_task(self):
+        pipeline = Pipeline()
+        pipeline.add("a", lambda: None)
+
+        with self.assertRaises(PipelineError):
+            pipeline.add("a", lambda: None)
+
+    def test_critical_path_includes_waiting_for_resource(self):
+        pipeline = Pipeline(max_workers=4, resource_limits={"llm": 1})
+        pipeline.add("a", lambda: time.sleep(0.1), resource="llm", priority=0)
+        pipeline.add("b", lambda: time.sleep(0.1), resource="llm", priority=1)
+        pipeline.add("c", lambda: None, resource="llm", priority=2)
+        pipeline.add("join", lambda *_: None, deps=("a", "b", "c"))
+        pipeline.run()
+
+        path = [t.name for t in pipeline.critical_path()]
+
+        self.assertEqual(path, ["a", "b", "c", "join"])
+        self.assertGreater(pipeline.tasks["c"].wait, 0.15)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+from i_hate_papers.scheduling import DeadlineScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class DeadlineSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = DeadlineScheduler(10, clock=self.clock)
+
+    def test_order(self):
+        order = self.scheduler.order(
+            ["Acknowledgements", "Methods", "Appendix", "Conclusion", "Abstract"]
+        )
+        self.assertEqual(
+            order, ["Abstract", "Conclusion", "Methods", "Appendix", "Acknowledgements"]
+        )
+
+    def test_full_detail_early_on(self):
+        self.clock.now += 4
+        self.assertEqual(self.scheduler.detail_level("Abstract", 2), 2)
+        self.assertEqual(self.scheduler.degraded, [])
+
+    def test_degrades_when_half_the_time_has_gone(self):
+        self.clock.now += 6
+        self.assertEqual(self.scheduler.detail_level("Methods", 2), 1)
+        self.assertEqual(self.scheduler.detail_level("Results", 0), 0)
+        self.assertEqual(self.scheduler.degraded, ["Methods"])
+
+    def test_skips_once_expired(self):
+        self.clock.now += 10
+        self.assertTrue(self.scheduler.expired)
+        self.assertIsNone(self.scheduler.detail_level("Methods", 1))
+        self.assertEqual(self.scheduler.skipped, ["Methods"])
+
+    def test_zero_deadline_skips_everything(self):
+        scheduler = DeadlineScheduler(0, clock=self.clock)
+        self.assertIsNone(scheduler.detail_level("Abstract", 1))
+
+    def test_allow(self):
+        self.clock.now += 7
+        self.assertTrue(self.scheduler.allow("Glossary", expected_seconds=2))
+        self.assertFalse(self.scheduler.allow("Glossary", expected_seconds=5))
+        self.assertEqual(self.scheduler.skipped, ["Glossary"])
+
+    def test_request_timeout(self):
+        self.assertEqual(self.scheduler.request_timeout(600), 10)
+        self.assertEqual(self.scheduler.request_timeout(5), 5)
+        self.clock.now += 20
+        self.assertGreater(self.scheduler.request_timeout(600), 0)
+
+    def test_timed_out(self):
+        self.clock.now += 6
+        self.scheduler.detail_level("Methods", 2)
+        self.scheduler.timed_out("Methods")
+        self.assertEqual(self.scheduler.skipped, ["Methods"])
+        self.assertEqual(self.scheduler.degraded, [])
+
+    def test_as_markdown(self):
+        self.assertIn("Completed in full", self.scheduler.as_markdown())
+        self.clock.now += 10
+        self.scheduler.detail_level("Methods", 1)
+        self.assertIn("Skipped: Methods", self.scheduler.as_markdown())
+
+
+if __name__ == "__main__":
+    unittest.main()